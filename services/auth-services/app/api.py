@@ -1,39 +1,111 @@
-import functools
-from typing import Any
-
+import base64
+import json
+import threading
+import time
+import urllib.request
+from typing import Mapping, Set
+
+from cachetools import TLRUCache, TTLCache
 from corelib.utils.validators import JwtValidator
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.security import HTTPBearer
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from app.config import AppConfig
 
 router = APIRouter()
 
-jwt_validator = JwtValidator(AppConfig().auth0_config)
+config = AppConfig()
+
+jwt_validator = JwtValidator(config.auth0_config)
+bearer_scheme = HTTPBearer(auto_error=False)
+token_cache = TLRUCache(maxsize=4096, ttu=lambda _token, expiration, _now: expiration, timer=time.time)
+signing_key_ids = TTLCache(maxsize=1, ttl=600)
+signing_key_ids_lock = threading.Lock()
 
 
-def require_auth(func) -> Any:
+def get_signing_key_ids(refresh: bool = False) -> Set[str]:
+    """
+    Gets the ids of the keys tokens can be signed with, from the JWKS of the
+    tenant, cached for 10 minutes. A refresh downloads the JWKS again at most
+    once a minute, so that tokens with unknown key ids cannot make every
+    request download it
+
+    :param refresh: whether the JWKS should be downloaded again
+    :return: the key ids
+    :raises HTTPException: if the JWKS cannot be downloaded
+    """
+    with signing_key_ids_lock:
+        cached = signing_key_ids.get("keys")
+        if cached and (not refresh or time.monotonic() - cached[0] < 60):
+            return cached[1]
+        try:
+            with urllib.request.urlopen(f"https://{config.auth0_config['DOMAIN']}/.well-known/jwks.json",
+                                        timeout=5) as response:
+                key_ids = {key["kid"] for key in json.load(response)["keys"]}
+        except (OSError, ValueError, KeyError):
+            raise HTTPException(status_code=503, detail="Signing keys unavailable")
+        signing_key_ids["keys"] = (time.monotonic(), key_ids)
+        return key_ids
+
+
+def decode_token_part(token: str, index: int) -> dict:
     """
-    Decorator to check for authorization before giving access to resources
+    Decodes the header or the payload of a token, without verifying it
 
-    :param func: the function that needs to be decorated
-    :return: the decorated function
+    :param token: the token
+    :param index: 0 for the header, 1 for the payload
+    :return: the decoded part
+    :raises ValueError: if the part is not a base64 encoded JSON object
     """
+    part = token.split(".")[index]
+    decoded = json.loads(base64.urlsafe_b64decode(part + "=" * (-len(part) % 4)))
+    if not isinstance(decoded, dict):
+        raise ValueError("Token part is not an object")
+    return decoded
 
-    @functools.wraps(func)
-    async def wrapper_require_auth(*args, **kwargs):
-        validate_bearer_token(kwargs["bearer_token"])
-        return await func(*args, **kwargs)
 
-    def validate_bearer_token(bearer_token) -> None:
-        if not bearer_token:
-            raise HTTPException(status_code=401, detail="User not authenticated")
-        if bearer_token.scheme != "Bearer":
-            raise HTTPException(status_code=401, detail="Authorization header must be "
-                                                        "of type bearer")
-        jwt_validator.validate(bearer_token.credentials)
+async def verify_token(
+        bearer_token: HTTPAuthorizationCredentials | None = Depends(bearer_scheme)) -> HTTPAuthorizationCredentials:
+    """
+    Dependency checking for authorization before giving access to resources.
+    The validator only verifies tokens signed with a key id of the JWKS, so
+    tokens with any other key id are rejected before it is called. Accepted
+    tokens are cached until their exp
 
-    return wrapper_require_auth
+    :param bearer_token: the bearer token for authorization
+    :return: the validated bearer token
+    :raises HTTPException: if authorization is invalid
+    """
+    if bearer_token and bearer_token.credentials in token_cache:
+        return bearer_token
+    if not bearer_token:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+    token = bearer_token.credentials
+    if token.count(".") != 2:
+        raise HTTPException(status_code=401, detail="Malformed token")
+    try:
+        key_id = decode_token_part(token, 0).get("kid")
+        payload = decode_token_part(token, 1)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Malformed token")
+    if key_id not in await run_in_threadpool(get_signing_key_ids) and \
+            key_id not in await run_in_threadpool(get_signing_key_ids, True):
+        raise HTTPException(status_code=401, detail="Unknown key id")
+    try:
+        claims = await run_in_threadpool(jwt_validator.validate, token)
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # With a known key id the validator raises on any invalid token, and when
+    # it returns no claims the payload decoded above is the verified one
+    if not isinstance(claims, Mapping):
+        claims = payload
+    if "exp" in claims:
+        token_cache[token] = float(claims["exp"])
+    return bearer_token
 
 
 @router.get("/ping", response_model=str, tags=["ping"])
@@ -43,12 +115,11 @@ async def ping():
 
     :return: a string saying "pong"
     """
-    return "pong"
+    return ORJSONResponse("pong")
 
 
 @router.get("/status", response_model=str, status_code=200, tags=["auth"])
-@require_auth
-async def status(bearer_token=Depends(HTTPBearer())):
+async def status(bearer_token=Depends(verify_token)):
     """
     Route for checking if the user is authenticated
 
@@ -56,4 +127,4 @@ async def status(bearer_token=Depends(HTTPBearer())):
     :return: a string saying "authenticated"
     :raises HTTPException: if authorization is invalid
     """
-    return "authenticated"
+    return ORJSONResponse("authenticated")
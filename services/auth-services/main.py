@@ -1,7 +1,9 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from app.api import router
 
-app = FastAPI(openapi_url="/api/v1/auth/openapi.json", docs_url="/api/v1/auth/docs")
+app = FastAPI(openapi_url="/api/v1/auth/openapi.json", docs_url="/api/v1/auth/docs",
+              default_response_class=ORJSONResponse)
 
 app.include_router(router, prefix='/api/v1/auth')
@@ -1,45 +1,117 @@
-import functools
-from typing import Any
-
-from corelib.domain.errors import NotFoundError, DuplicateError
+import base64
+import json
+import threading
+import time
+import urllib.request
+from typing import Mapping, Set
+
+from cachetools import TLRUCache, TTLCache
 from corelib.utils.validators import JwtValidator
-from fastapi import APIRouter, HTTPException, Depends, Request
-from fastapi.security import HTTPBearer
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from app.config import AppConfig
 from app.repositories import Neo4jGroupRepository
+from app.schemas import AddGroupRequest, UpdateGroupRequest, AddMemberRequest
 from app.services import GroupServices
 
 router = APIRouter()
 
-jwt_validator = JwtValidator(AppConfig().auth0_config)
+config = AppConfig()
+
+jwt_validator = JwtValidator(config.auth0_config)
+bearer_scheme = HTTPBearer(auto_error=False)
+token_cache = TLRUCache(maxsize=4096, ttu=lambda _token, expiration, _now: expiration, timer=time.time)
+signing_key_ids = TTLCache(maxsize=1, ttl=600)
+signing_key_ids_lock = threading.Lock()
 
 group_repository = Neo4jGroupRepository()
 group_services = GroupServices(group_repository)
 
 
-def require_auth(func) -> Any:
+def get_signing_key_ids(refresh: bool = False) -> Set[str]:
     """
-    Decorator to check for authorization before giving access to resources
+    Gets the ids of the keys tokens can be signed with, from the JWKS of the
+    tenant, cached for 10 minutes. A refresh downloads the JWKS again at most
+    once a minute, so that tokens with unknown key ids cannot make every
+    request download it
 
-    :param func: the function that needs to be decorated
-    :return: the decorated function
+    :param refresh: whether the JWKS should be downloaded again
+    :return: the key ids
+    :raises HTTPException: if the JWKS cannot be downloaded
     """
+    with signing_key_ids_lock:
+        cached = signing_key_ids.get("keys")
+        if cached and (not refresh or time.monotonic() - cached[0] < 60):
+            return cached[1]
+        try:
+            with urllib.request.urlopen(f"https://{config.auth0_config['DOMAIN']}/.well-known/jwks.json",
+                                        timeout=5) as response:
+                key_ids = {key["kid"] for key in json.load(response)["keys"]}
+        except (OSError, ValueError, KeyError):
+            raise HTTPException(status_code=503, detail="Signing keys unavailable")
+        signing_key_ids["keys"] = (time.monotonic(), key_ids)
+        return key_ids
+
 
-    @functools.wraps(func)
-    async def wrapper_require_auth(*args, **kwargs):
-        validate_bearer_token(kwargs["bearer_token"])
-        return await func(*args, **kwargs)
+def decode_token_part(token: str, index: int) -> dict:
+    """
+    Decodes the header or the payload of a token, without verifying it
 
-    def validate_bearer_token(bearer_token) -> None:
-        if not bearer_token:
-            raise HTTPException(status_code=401, detail="User not authenticated")
-        if bearer_token.scheme != "Bearer":
-            raise HTTPException(status_code=401, detail="Authorization header must be "
-                                                        "of type bearer")
-        jwt_validator.validate(bearer_token.credentials)
+    :param token: the token
+    :param index: 0 for the header, 1 for the payload
+    :return: the decoded part
+    :raises ValueError: if the part is not a base64 encoded JSON object
+    """
+    part = token.split(".")[index]
+    decoded = json.loads(base64.urlsafe_b64decode(part + "=" * (-len(part) % 4)))
+    if not isinstance(decoded, dict):
+        raise ValueError("Token part is not an object")
+    return decoded
 
-    return wrapper_require_auth
+
+async def verify_token(
+        bearer_token: HTTPAuthorizationCredentials | None = Depends(bearer_scheme)) -> HTTPAuthorizationCredentials:
+    """
+    Dependency checking for authorization before giving access to resources.
+    The validator only verifies tokens signed with a key id of the JWKS, so
+    tokens with any other key id are rejected before it is called. Accepted
+    tokens are cached until their exp
+
+    :param bearer_token: the bearer token for authorization
+    :return: the validated bearer token
+    :raises HTTPException: if authorization is invalid
+    """
+    if bearer_token and bearer_token.credentials in token_cache:
+        return bearer_token
+    if not bearer_token:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+    token = bearer_token.credentials
+    if token.count(".") != 2:
+        raise HTTPException(status_code=401, detail="Malformed token")
+    try:
+        key_id = decode_token_part(token, 0).get("kid")
+        payload = decode_token_part(token, 1)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Malformed token")
+    if key_id not in await run_in_threadpool(get_signing_key_ids) and \
+            key_id not in await run_in_threadpool(get_signing_key_ids, True):
+        raise HTTPException(status_code=401, detail="Unknown key id")
+    try:
+        claims = await run_in_threadpool(jwt_validator.validate, token)
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # With a known key id the validator raises on any invalid token, and when
+    # it returns no claims the payload decoded above is the verified one
+    if not isinstance(claims, Mapping):
+        claims = payload
+    if "exp" in claims:
+        token_cache[token] = float(claims["exp"])
+    return bearer_token
 
 
 @router.get("/ping", response_model=str, tags=["ping"])
@@ -49,12 +121,11 @@ async def ping():
 
     :return: a string saying "pong"
     """
-    return "pong"
+    return ORJSONResponse("pong")
 
 
-@router.get("/{group_id}", status_code=200, tags=["group"])
-@require_auth
-async def get_group(group_id: str, bearer_token=Depends(HTTPBearer())):
+@router.get("/{group_id}", status_code=200, response_model=None, tags=["group"])
+async def get_group(group_id: str, bearer_token=Depends(verify_token)):
     """
     Route for getting a group by id
 
@@ -63,96 +134,61 @@ async def get_group(group_id: str, bearer_token=Depends(HTTPBearer())):
     :return: the corresponding group
     :raises HTTPException: if group not found or authorization is invalid
     """
-    try:
-        group = group_services.get_group(group_id)
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    group = await run_in_threadpool(group_services.get_group, group_id)
     return group.as_dict()
 
 
-@router.get("/", status_code=200, tags=["group"])
-@require_auth
-async def get_groups(nickname: str = "", bearer_token=Depends(HTTPBearer())):
+@router.get("/", status_code=200, response_model=None, tags=["group"])
+async def get_groups(nickname: str = "", offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500),
+                     bearer_token=Depends(verify_token)):
     """
-    Route for getting multiple groups
+    Route for getting a page of groups
 
     :param nickname: the nickname of the group to filter by
+    :param offset: the number of groups to skip
+    :param limit: the maximum number of groups to return
     :param bearer_token: the bearer token for authorization
     :return: the corresponding groups
     :raises HTTPException: if authorization is invalid
     """
-    try:
-        groups = group_services.get_groups(nickname)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    groups = await run_in_threadpool(group_services.get_groups, nickname, offset=offset, limit=limit)
     return [group.as_dict() for group in groups]
 
 
 @router.post("/", status_code=201, tags=["group"])
-@require_auth
-async def add_group(request: Request, bearer_token=Depends(HTTPBearer())):
+async def add_group(body: AddGroupRequest, bearer_token=Depends(verify_token)):
     """
     Route for adding a new group
 
-    :param request: the request object containing the group to be added
+    :param body: the group to be added and the user creating it
     :param bearer_token: the bearer token for authorization
     :return: status message
     :raises HTTPException: if authorization is invalid or if group already
     exists or if group is invalid or if the user already belongs to a group
     """
-    try:
-        json_data = await request.json()
-        group_services.add_group(json_data["user_id"], json_data["nickname"], json_data["name"],
-                                 bearer_token.credentials)
-    except DuplicateError as e:
-        raise HTTPException(status_code=409, detail=str(e))
-    except KeyError:
-        raise HTTPException(status_code=400, detail="Missing required fields")
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    await run_in_threadpool(group_services.add_group, body.user_id, body.nickname, body.name)
     return {"message": "Group added"}
 
 
 @router.put("/{group_id}", status_code=200, tags=["group"])
-@require_auth
-async def update_group(group_id: str, request: Request, bearer_token=Depends(HTTPBearer())):
+async def update_group(group_id: str, body: UpdateGroupRequest, bearer_token=Depends(verify_token)):
     """
     Route for updating a group
 
     :param group_id: the id of the group to be updated
-    :param request: the request object containing the group to be updated
+    :param body: the updated group
     :param bearer_token: the bearer token for authorization
     :return: status message
     :raises HTTPException: if group not found or authorization is invalid or if
     group is invalid
     """
-    try:
-        json_data = await request.json()
-        group_services.update_group(json_data["nickname"], json_data["name"], json_data["today_steps"],
-                                    json_data["daily_steps_goal"], json_data["this_week_steps"],
-                                    json_data["weekly_steps_goal"])
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except KeyError:
-        raise HTTPException(status_code=400, detail="Missing required fields")
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    await run_in_threadpool(group_services.update_group, body.nickname, body.name, body.today_steps,
+                            body.daily_steps_goal, body.this_week_steps, body.weekly_steps_goal)
     return {"message": "Group updated"}
 
 
 @router.delete("/{group_id}", status_code=200, tags=["group"])
-@require_auth
-async def delete_group(group_id: str, bearer_token=Depends(HTTPBearer())):
+async def delete_group(group_id: str, bearer_token=Depends(verify_token)):
     """
     Route for deleting a group
 
@@ -161,19 +197,12 @@ async def delete_group(group_id: str, bearer_token=Depends(HTTPBearer())):
     :return: status message
     :raises HTTPException: if group not found or authorization is invalid
     """
-    try:
-        group_services.delete_group(group_id)
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    await run_in_threadpool(group_services.delete_group, group_id)
     return {"message": "Group deleted"}
 
 
-@router.get("/{group_id}/members", status_code=200, tags=["group, user"])
-@require_auth
-async def get_members_of_group(group_id: str, bearer_token=Depends(HTTPBearer())):
+@router.get("/{group_id}/members", status_code=200, response_model=None, tags=["group, user"])
+async def get_members_of_group(group_id: str, bearer_token=Depends(verify_token)):
     """
     Route for getting all members of a group
 
@@ -182,50 +211,29 @@ async def get_members_of_group(group_id: str, bearer_token=Depends(HTTPBearer())
     :return: the members of the group
     :raises HTTPException: if group not found or authorization is invalid
     """
-    try:
-        members = group_services.get_members_of_group(group_id)
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    members = await run_in_threadpool(group_services.get_members_of_group, group_id)
     return [member.as_dict() for member in members]
 
 
 @router.put("/{group_id}/members", status_code=200, tags=["group, "
                                                           "user"])
-@require_auth
-async def add_member_to_group(group_id: str, request: Request, bearer_token=Depends(HTTPBearer())):
+async def add_member_to_group(group_id: str, body: AddMemberRequest, bearer_token=Depends(verify_token)):
     """
     Route for adding a user to a group
 
     :param group_id: the id of the group to add the user to
-    :param request: the request object containing the user to be added
+    :param body: the user to be added
     :param bearer_token: the bearer token for authorization
     :return: status message
     :raises HTTPException: if authorization is invalid or if user already
     belongs to a group or if user is invalid
     """
-    try:
-        json_data = await request.json()
-        group_services.add_member_to_group(json_data["user_id"], group_id, bearer_token.credentials)
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except DuplicateError as e:
-        raise HTTPException(status_code=409, detail=str(e))
-    except KeyError:
-        raise HTTPException(status_code=400, detail="Missing required fields")
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    await run_in_threadpool(group_services.add_member_to_group, body.user_id, group_id)
     return {"message": "User added"}
 
 
 @router.delete("/{group_id}/members/{user_id}", status_code=200, tags=["group, user"])
-@require_auth
-async def remove_member_from_group(user_id: str, group_id: str, bearer_token=Depends(HTTPBearer())):
+async def remove_member_from_group(user_id: str, group_id: str, bearer_token=Depends(verify_token)):
     """
     Route for removing a user from a group
 
@@ -235,11 +243,5 @@ async def remove_member_from_group(user_id: str, group_id: str, bearer_token=Dep
     :return: status message
     :raises HTTPException: if user not found or authorization is invalid
     """
-    try:
-        group_services.remove_member_from_group(user_id, group_id, bearer_token.credentials)
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    await run_in_threadpool(group_services.remove_member_from_group, user_id, group_id)
     return {"message": "User removed"}
@@ -10,7 +10,6 @@ class AppConfig:
     config = None
     auth0_config = None
     neo4j_config = None
-    user_services_url = None
 
     def __new__(cls):
         if cls.__instance is None:
@@ -27,7 +26,6 @@ class AppConfig:
                             cls.neo4j_config["PASSWORD"] = db_password_file.readline()
                     except KeyError:
                         raise NotFoundError(f"database password not found in the environment")
-                cls.user_services_url = os.environ["USER_SERVICES_URL"]
             except KeyError as e:
                 raise NotFoundError(f"{e} config not found")
         return cls.__instance
@@ -1,23 +1,83 @@
+import functools
+import logging
 from typing import List
 
 from corelib.domain.errors import NotFoundError, DuplicateError
 from corelib.domain.models import User, Group
 from corelib.repositories import Repository
-from neo4j import Neo4jDriver, GraphDatabase
+from neo4j import Neo4jDriver, GraphDatabase, Record, RoutingControl, Session, WRITE_ACCESS
+from neo4j.exceptions import ConstraintError, Neo4jError
 
 from app.config import AppConfig
 
+config = AppConfig()
+database = config.neo4j_config.get("DATABASE", "neo4j")
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=1)
+def default_driver() -> Neo4jDriver:
+    """
+    Creates the driver shared by the repositories on first use
+
+    :return: the driver
+    """
+    return GraphDatabase.driver(uri=config.neo4j_config["HOST"],
+                                auth=(config.neo4j_config["USER"], config.neo4j_config["PASSWORD"]),
+                                max_connection_pool_size=config.neo4j_config.getint("POOL_SIZE", fallback=100),
+                                connection_acquisition_timeout=30)
+
 
 class Neo4jGroupRepository(Repository):
     """Neo4J repository for groups"""
 
     driver: Neo4jDriver
 
-    def __init__(self, driver: Neo4jDriver = GraphDatabase.driver(uri=AppConfig().neo4j_config['HOST'], auth=(
-            AppConfig().neo4j_config['USER'], AppConfig().neo4j_config['PASSWORD']))) -> None:
-        self.driver = driver
+    def __init__(self, driver: Neo4jDriver | None = None) -> None:
+        self.driver = driver or default_driver()
         super().__init__({})
 
+    def _session(self) -> Session:
+        """
+        Opens a session on the configured database, for the transaction
+        functions that write
+
+        :return: the session
+        """
+        return self.driver.session(database=database, default_access_mode=WRITE_ACCESS)
+
+    def _execute(self, query: str, routing: RoutingControl = RoutingControl.WRITE, **parameters) -> List[Record]:
+        """
+        Runs a single query in a driver managed transaction on the configured
+        database
+
+        :param query: the query to run
+        :param routing: whether the query reads or writes
+        :param parameters: the query parameters
+        :return: the records returned by the query
+        """
+        return self.driver.execute_query(query, parameters, routing_=routing, database_=database).records
+
+    def ensure_schema(self) -> None:
+        """
+        Creates the uniqueness constraint on the group key used for lookups
+        and the text indexes serving the group name filters, if they do not
+        exist. Each statement runs in its own retried transaction, and a
+        statement that still fails, for example because of existing duplicate
+        keys, is logged instead of stopping the service
+
+        :return: None
+        """
+        for statement in [f"CREATE CONSTRAINT group_{Group.__primarykey__}_unique IF NOT EXISTS "
+                          f"FOR (g:Group) REQUIRE g.{Group.__primarykey__} IS UNIQUE",
+                          "CREATE TEXT INDEX group_nickname_text IF NOT EXISTS FOR (g:Group) ON (g.nickname)",
+                          "CREATE TEXT INDEX group_name_text IF NOT EXISTS FOR (g:Group) ON (g.name)"]:
+            try:
+                self._execute(statement)
+            except Neo4jError as e:
+                logger.warning("Could not apply the group schema: %s", e)
+
     def get_one(self, group_id: str) -> Group:
         """
         Get one group by id
@@ -26,19 +86,13 @@ class Neo4jGroupRepository(Repository):
         :return: The group
         :raises NotFoundError: If the group does not exist
         """
-
-        def _get_group(tx, primary_key: str):
-            result = tx.run(f"MATCH (g:Group {{{Group.__primarykey__}: '{primary_key}'}}) "
-                            f"RETURN g "
-                            f"LIMIT 1")
-            record = result.single()
-            if record is not None:
-                return Group(**record.data()['g'])
-            else:
-                raise NotFoundError("Group not found")
-
-        with self.driver.session() as session:
-            return session.read_transaction(_get_group, group_id)
+        records = self._execute(f"MATCH (g:Group {{{Group.__primarykey__}: $group_id}}) "
+                                f"RETURN properties(g) AS p "
+                                f"LIMIT 1", RoutingControl.READ, group_id=group_id)
+        if records:
+            return Group(**records[0]["p"])
+        else:
+            raise NotFoundError("Group not found")
 
     def get_all(self) -> List[Group]:
         """
@@ -46,14 +100,69 @@ class Neo4jGroupRepository(Repository):
 
         :return: A list of all groups
         """
+        records = self._execute("MATCH (g:Group) "
+                                "RETURN properties(g) AS p", RoutingControl.READ)
+        return [Group(**record["p"]) for record in records]
 
-        def _get_all_groups(tx):
-            result = tx.run(f"MATCH (g:Group) "
-                            f"RETURN g")
-            return [Group(**record.data()['g']) for record in result]
+    def get_page(self, skip: int = 0, limit: int = 50) -> List[Group]:
+        """
+        Get a page of groups, ordered by id
 
-        with self.driver.session() as session:
-            return session.read_transaction(_get_all_groups)
+        :param skip: The number of groups to skip
+        :param limit: The maximum number of groups to return
+        :return: A list of at most limit groups
+        """
+        records = self._execute(f"MATCH (g:Group) "
+                                f"WHERE g.{Group.__primarykey__} IS NOT NULL "
+                                f"WITH g ORDER BY g.{Group.__primarykey__} "
+                                f"SKIP $skip LIMIT $limit "
+                                f"RETURN properties(g) AS p", RoutingControl.READ, skip=skip, limit=limit)
+        return [Group(**record["p"]) for record in records]
+
+    def get_filtered(self, nickname_filter: str, name_also: bool = True, loose: bool = True, skip: int = 0,
+                     limit: int = 50) -> List[Group]:
+        """
+        Get a page of the groups whose nickname, or optionally name, matches a
+        filter, ordered by id
+
+        :param nickname_filter: The filter to match
+        :param name_also: If the name also must be checked
+        :param loose: If the filter should match parts of the nickname
+        :param skip: The number of matching groups to skip
+        :param limit: The maximum number of groups to return
+        :return: A list of at most limit matching groups
+        """
+        operator = "CONTAINS" if loose else "="
+        fields = ["nickname", "name"] if name_also else ["nickname"]
+        # One branch per field so that each lookup can use the index on its
+        # field, which an OR across both fields cannot
+        query = " UNION ".join(f"MATCH (g:Group) "
+                               f"WHERE g.{field} {operator} $filter "
+                               f"RETURN g" for field in fields)
+        records = self._execute(f"CALL {{ {query} }} "
+                                f"WITH g ORDER BY g.{Group.__primarykey__} "
+                                f"SKIP $skip LIMIT $limit "
+                                f"RETURN properties(g) AS p", RoutingControl.READ, filter=nickname_filter, skip=skip,
+                                limit=limit)
+        return [Group(**record["p"]) for record in records]
+
+    @staticmethod
+    def _create_group(tx, group: Group) -> None:
+        """
+        Create a group in a transaction
+
+        :param tx: The transaction
+        :param group: The group to be created
+        :return: None
+        :raises DuplicateError: If the group already exists
+        """
+        record = tx.run(f"OPTIONAL MATCH (existing:Group {{{Group.__primarykey__}: $group_id}}) "
+                        f"WITH existing WHERE existing IS NULL "
+                        f"CREATE (g:Group $props) "
+                        f"RETURN count(g) AS created",
+                        group_id=getattr(group, Group.__primarykey__), props=group.as_dict()).single()
+        if not record["created"]:
+            raise DuplicateError("Group already exists")
 
     def add(self, group: Group) -> None:
         """
@@ -63,16 +172,45 @@ class Neo4jGroupRepository(Repository):
         :return: None
         :raises DuplicateError: If the group already exists
         """
+        try:
+            with self._session() as session:
+                session.execute_write(self._create_group, group)
+        except ConstraintError:
+            raise DuplicateError("Group already exists")
 
-        def _add_group(tx, group: Group):
-            tx.run(f"CREATE (g:Group {group.as_str_dict()})")
+    def add_with_member(self, group: Group, user_id: str) -> None:
+        """
+        Add a group to the repository together with the user that creates it, in
+        a single transaction
+
+        :param group: The group to be added
+        :param user_id: The id of the user that creates the group
+        :return: None
+        :raises NotFoundError: If the user does not exist
+        :raises DuplicateError: If the user already belongs to a group or if the
+        group already exists
+        """
+
+        def _add_group_with_member(tx, group: Group, user_primary_key: str):
+            record = tx.run(f"OPTIONAL MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                            f"OPTIONAL MATCH (u)-[:MEMBER_OF]->(current:Group) "
+                            f"RETURN u IS NOT NULL AS user_exists, current IS NOT NULL AS has_group "
+                            f"LIMIT 1", user_id=user_primary_key).single()
+            if not record["user_exists"]:
+                raise NotFoundError("User not found")
+            if record["has_group"]:
+                raise DuplicateError("The user already has a group")
+            self._create_group(tx, group)
+            tx.run(f"MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                   f"MATCH (g:Group {{{Group.__primarykey__}: $group_id}}) "
+                   f"CREATE (u)-[:MEMBER_OF]->(g)",
+                   user_id=user_primary_key, group_id=getattr(group, Group.__primarykey__)).consume()
 
         try:
-            self.get_one(getattr(group, Group.__primarykey__))
+            with self._session() as session:
+                session.execute_write(_add_group_with_member, group, user_id)
+        except ConstraintError:
             raise DuplicateError("Group already exists")
-        except NotFoundError:
-            with self.driver.session() as session:
-                session.write_transaction(_add_group, group)
 
     def update(self, group: Group) -> None:
         """
@@ -82,15 +220,12 @@ class Neo4jGroupRepository(Repository):
         :return: None
         :raises NotFoundError: If the group does not exist
         """
-
-        def _update_group(tx, group: Group):
-            tx.run(f"MATCH (g:Group {{{Group.__primarykey__}: "
-                   f"'{getattr(group, Group.__primarykey__)}'}}) "
-                   f"SET g = {group.as_str_dict()}")
-
-        self.get_one(getattr(group, Group.__primarykey__))
-        with self.driver.session() as session:
-            session.write_transaction(_update_group, group)
+        records = self._execute(f"MATCH (g:Group {{{Group.__primarykey__}: $group_id}}) "
+                                f"SET g = $props "
+                                f"RETURN count(g) AS matched",
+                                group_id=getattr(group, Group.__primarykey__), props=group.as_dict())
+        if not records[0]["matched"]:
+            raise NotFoundError("Group not found")
 
     def delete(self, group_id: str) -> None:
         """
@@ -100,14 +235,11 @@ class Neo4jGroupRepository(Repository):
         :return: None
         :raises: NotFoundError: If the group does not exist
         """
-
-        def _delete_group(tx, primary_key: str):
-            tx.run(f"MATCH (g:Group {{{Group.__primarykey__}: '{primary_key}'}}) "
-                   f"DETACH DELETE g")
-
-        self.get_one(group_id)
-        with self.driver.session() as session:
-            session.write_transaction(_delete_group, group_id)
+        records = self._execute(f"MATCH (g:Group {{{Group.__primarykey__}: $group_id}}) "
+                                f"DETACH DELETE g "
+                                f"RETURN count(g) AS matched", group_id=group_id)
+        if not records[0]["matched"]:
+            raise NotFoundError("Group not found")
 
     def get_members_of_group(self, group_id: str) -> List[User]:
         """
@@ -117,70 +249,74 @@ class Neo4jGroupRepository(Repository):
         :return: A list of all members of the group
         :raises NotFoundError: If the group does not exist
         """
-
-        def _get_members_of_group(tx, primary_key: str):
-            result = tx.run(f"MATCH (u:User)-[:MEMBER_OF]->(g:Group "
-                            f"{{{Group.__primarykey__}: '{primary_key}'}}) "
-                            f"RETURN u")
-            return [User(**record.data()['u']) for record in result]
-
-        self.get_one(group_id)
-        with self.driver.session() as session:
-            return session.read_transaction(_get_members_of_group, group_id)
+        records = self._execute(f"MATCH (g:Group {{{Group.__primarykey__}: $group_id}}) "
+                                f"OPTIONAL MATCH (u:User)-[:MEMBER_OF]->(g) "
+                                f"RETURN g.{Group.__primarykey__} AS group_id, collect(properties(u)) AS members",
+                                RoutingControl.READ, group_id=group_id)
+        if not records:
+            raise NotFoundError("Group not found")
+        return [User(**properties) for properties in records[0]["members"]]
 
     def add_member_to_group(self, user_id: str, group_id: str) -> None:
         """
-        Add members to a group
+        Add members to a group, adding the steps of the member to the steps of
+        the group
 
         :param user_id: The id of the user to be added
         :param group_id: The id of the group to be added to
         :return: None
         :raises NotFoundError: If the user or group does not exist
+        :raises DuplicateError: If the user is already a member of this group or
+        another group
         """
-
-        def _add_member(tx, user_primary_key: str, group_primary_key: str):
-            result = tx.run(f"MATCH (u:User {{{User.__primarykey__}: "
-                            f"'{user_primary_key}'}}) "
-                            f"RETURN u")
-            record = result.single()
-            if record:
-                tx.run(f"MATCH (u:User {{{User.__primarykey__}: "
-                       f"'{user_primary_key}'}}) "
-                       f"MATCH (g:Group {{{Group.__primarykey__}: "
-                       f"'{group_primary_key}'}}) "
-                       f"CREATE (u)-[:MEMBER_OF]->(g)")
-            else:
-                raise NotFoundError("User not found")
-
-        self.get_one(group_id)
-        with self.driver.session() as session:
-            session.write_transaction(_add_member, user_id, group_id)
+        records = self._execute(f"OPTIONAL MATCH (g:Group {{{Group.__primarykey__}: $group_id}}) "
+                                f"OPTIONAL MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                                f"OPTIONAL MATCH (u)-[:MEMBER_OF]->(current:Group) "
+                                f"WITH g, u, collect(current.{Group.__primarykey__}) AS current_groups "
+                                f"FOREACH (_ IN CASE WHEN u IS NOT NULL AND g IS NOT NULL AND size(current_groups) = 0 "
+                                f"THEN [1] ELSE [] END | "
+                                f"CREATE (u)-[:MEMBER_OF]->(g) "
+                                f"SET g.today_steps = g.today_steps + u.today_steps, "
+                                f"g.this_week_steps = g.this_week_steps + u.this_week_steps) "
+                                f"RETURN g IS NOT NULL AS group_exists, u IS NOT NULL AS user_exists, current_groups",
+                                user_id=user_id, group_id=group_id)
+        record = records[0]
+        if not record["group_exists"]:
+            raise NotFoundError("Group not found")
+        if not record["user_exists"]:
+            raise NotFoundError("User not found")
+        if group_id in record["current_groups"]:
+            raise DuplicateError("The user is already a member of the group")
+        if record["current_groups"]:
+            raise DuplicateError("The user is already a member of a group")
 
     def remove_member_from_group(self, user_id: str, group_id: str) -> None:
         """
-        Remove members from a group
+        Remove members from a group, subtracting the steps of the member from
+        the steps of the group. The group is deleted once its last member is
+        removed
 
         :param user_id: The id of the user to be removed
         :param group_id: The id of the group to be removed from
         :return: None
         :raises NotFoundError: If the user or group does not exist
         """
-
-        def _remove_member(tx, user_primary_key: str, group_primary_key: str):
-            result = tx.run(f"MATCH (u:User {{{User.__primarykey__}:"
-                            f"'{user_primary_key}'}}) "
-                            f"RETURN u")
-            record = result.single()
-            if record:
-                tx.run(f"MATCH (u:User {{{User.__primarykey__}: "
-                       f"'{user_primary_key}'}}) "
-                       f"MATCH (g:Group {{{Group.__primarykey__}: "
-                       f"'{group_primary_key}'}}) "
-                       f"MATCH (u)-[r:MEMBER_OF]->(g) "
-                       f"DELETE r")
-            else:
-                raise NotFoundError("User not found")
-
-        self.get_one(group_id)
-        with self.driver.session() as session:
-            session.write_transaction(_remove_member, user_id, group_id)
+        records = self._execute(f"OPTIONAL MATCH (g:Group {{{Group.__primarykey__}: $group_id}}) "
+                                f"OPTIONAL MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                                f"OPTIONAL MATCH (u)-[r:MEMBER_OF]->(g) "
+                                f"FOREACH (_ IN CASE WHEN r IS NOT NULL THEN [1] ELSE [] END | "
+                                f"SET g.today_steps = g.today_steps - u.today_steps, "
+                                f"g.this_week_steps = g.this_week_steps - u.this_week_steps) "
+                                f"DELETE r "
+                                f"WITH g, g IS NOT NULL AS group_exists, u IS NOT NULL AS user_exists "
+                                f"OPTIONAL MATCH (g)<-[remaining:MEMBER_OF]-(:User) "
+                                f"WITH g, group_exists, user_exists, count(remaining) AS members "
+                                f"FOREACH (_ IN CASE WHEN group_exists AND user_exists AND members = 0 "
+                                f"THEN [1] ELSE [] END | "
+                                f"DETACH DELETE g) "
+                                f"RETURN group_exists, user_exists",
+                                user_id=user_id, group_id=group_id)
+        if not records[0]["group_exists"]:
+            raise NotFoundError("Group not found")
+        if not records[0]["user_exists"]:
+            raise NotFoundError("User not found")
@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+
+
+class AddGroupRequest(BaseModel):
+    """The body of a request for adding a new group"""
+    user_id: str
+    nickname: str
+    name: str
+
+
+class UpdateGroupRequest(BaseModel):
+    """The body of a request for updating a group"""
+    nickname: str
+    name: str
+    today_steps: int
+    daily_steps_goal: int
+    this_week_steps: int
+    weekly_steps_goal: int
+
+
+class AddMemberRequest(BaseModel):
+    """The body of a request for adding a member to a group"""
+    user_id: str
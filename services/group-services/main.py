@@ -1,7 +1,75 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
 
-from app.api import router
+from corelib.domain.errors import NotFoundError, DuplicateError
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 
-app = FastAPI(openapi_url="/api/v1/groups/openapi.json", docs_url="/api/v1/groups/docs")
+from app.api import router, group_repository
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Prepares the database before the app starts serving requests and closes
+    the connections to it on shutdown
+
+    :param app: the app
+    """
+    await run_in_threadpool(group_repository.ensure_schema)
+    yield
+    await run_in_threadpool(group_repository.driver.close)
+
+
+app = FastAPI(openapi_url="/api/v1/groups/openapi.json", docs_url="/api/v1/groups/docs",
+              default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.include_router(router, prefix='/api/v1/groups')
+
+
+@app.exception_handler(NotFoundError)
+async def not_found_error_handler(request: Request, exc: NotFoundError):
+    """
+    Responds with 404 when a resource cannot be found
+
+    :param request: the request that failed
+    :param exc: the raised error
+    :return: the error response
+    """
+    return ORJSONResponse(status_code=404, content={"detail": str(exc)})
+
+
+@app.exception_handler(DuplicateError)
+async def duplicate_error_handler(request: Request, exc: DuplicateError):
+    """
+    Responds with 409 when a resource already exists
+
+    :param request: the request that failed
+    :param exc: the raised error
+    :return: the error response
+    """
+    return ORJSONResponse(status_code=409, content={"detail": str(exc)})
+
+
+@app.exception_handler(ValueError)
+async def value_error_handler(request: Request, exc: ValueError):
+    """
+    Responds with 400 when the request data is not valid
+
+    :param request: the request that failed
+    :param exc: the raised error
+    :return: the error response
+    """
+    return ORJSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(Exception)
+async def internal_error_handler(request: Request, exc: Exception):
+    """
+    Responds with 500 when an unexpected error occurs
+
+    :param request: the request that failed
+    :param exc: the raised error
+    :return: the error response
+    """
+    return ORJSONResponse(status_code=500, content={"detail": f"Internal server error: {str(exc)}"})
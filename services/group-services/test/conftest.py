@@ -0,0 +1,85 @@
+import http.client
+import json
+import uuid
+from typing import List
+
+import pytest
+from corelib.domain.models import User, Group
+from neo4j.exceptions import DriverError, Neo4jError
+
+from app import repositories
+from app.repositories import Neo4jGroupRepository
+
+
+class Graph:
+    """Users and groups written straight to the database for a test, and deleted after it"""
+
+    def __init__(self, repo: Neo4jGroupRepository) -> None:
+        self.repo = repo
+        self.prefix = f"t{uuid.uuid4().hex[:8]}"
+        self.user_ids: List[str] = []
+        self.group_ids: List[str] = []
+
+    def _run(self, query: str, **parameters) -> None:
+        self.repo.driver.execute_query(query, parameters, database_=repositories.database)
+
+    def user(self, name: str, today_steps: int = 0, this_week_steps: int = 0) -> User:
+        user = User(sub=f"{self.prefix}{name}", name=name, given_name=name, family_name=name, nickname=name,
+                    email='test@test.test', picture='test', today_steps=today_steps, this_week_steps=this_week_steps)
+        self._run("CREATE (:User $props)", props=user.as_dict())
+        self.user_ids.append(user.id)
+        return user
+
+    def group(self, nickname: str, *members: User, name: str | None = None) -> Group:
+        group = self.new_group(nickname, name)
+        group.today_steps = sum(member.today_steps for member in members)
+        group.this_week_steps = sum(member.this_week_steps for member in members)
+        self._run(f"CREATE (g:Group $props) "
+                  f"WITH g "
+                  f"UNWIND $user_ids AS user_id "
+                  f"MATCH (u:User {{{User.__primarykey__}: user_id}}) "
+                  f"CREATE (u)-[:MEMBER_OF]->(g)",
+                  props=group.as_dict(), user_ids=[member.id for member in members])
+        return group
+
+    def new_group(self, nickname: str, name: str | None = None) -> Group:
+        group = Group(nickname=f"{self.prefix}{nickname}", name=name or nickname)
+        self.group_ids.append(group.id)
+        return group
+
+    def clear(self) -> None:
+        self._run(f"MATCH (n) "
+                  f"WHERE (n:User AND n.{User.__primarykey__} IN $user_ids) "
+                  f"OR (n:Group AND n.{Group.__primarykey__} IN $group_ids) "
+                  f"DETACH DELETE n", user_ids=self.user_ids, group_ids=self.group_ids)
+
+
+@pytest.fixture(scope="session")
+def repo() -> Neo4jGroupRepository:
+    repo = Neo4jGroupRepository()
+    try:
+        repo.driver.verify_connectivity()
+    except (DriverError, Neo4jError):
+        pytest.skip("The database is not reachable")
+    return repo
+
+
+@pytest.fixture
+def graph(repo) -> Graph:
+    graph = Graph(repo)
+    yield graph
+    graph.clear()
+
+
+@pytest.fixture(scope="session")
+def access_token() -> str:
+    conn = http.client.HTTPSConnection("dev-ed4pmqgq.eu.auth0.com")
+    payload = "{\"client_id\":\"V6ZVwOyzvgxrhqiZJeb1RHGypfVORq3T\"," \
+              "\"client_secret\":\"2eOAvMzqd1BX7QF9D" \
+              "-Fl6iom1B8pbXFvJVX7uMPp9PDTkL2_wBrmFLGh3ojlivCc\"," \
+              "\"audience\":\"mooover/api\",\"grant_type\":\"client_credentials\"} "
+    headers = {'content-type': "application/json"}
+    conn.request("POST", "/oauth/token", payload, headers)
+    res = conn.getresponse()
+    data = res.read()
+    return json.loads(data)["access_token"]
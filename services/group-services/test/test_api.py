@@ -0,0 +1,37 @@
+import pytest
+from starlette.testclient import TestClient
+
+from app import api
+from main import app
+
+
+@pytest.fixture(scope="module")
+def client() -> TestClient:
+    return TestClient(app)
+
+
+class TestGetGroups:
+    client: TestClient
+    calls: list
+
+    @pytest.fixture(autouse=True)
+    def setup(self, client, monkeypatch):
+        self.client = client
+        self.calls = []
+
+        def get_groups(nickname_filter, offset, limit):
+            self.calls.append((nickname_filter, offset, limit))
+            return []
+
+        monkeypatch.setattr(api.group_services, "get_groups", get_groups)
+        monkeypatch.setitem(app.dependency_overrides, api.verify_token, lambda: None)
+
+    def test_paging_is_passed_to_the_services(self):
+        assert self.client.get("/api/v1/groups/").status_code == 200
+        assert self.client.get("/api/v1/groups/?nickname=a&offset=500&limit=500").status_code == 200
+        assert self.calls == [("", 0, 50), ("a", 500, 500)]
+
+    @pytest.mark.parametrize("query", ["offset=-1", "limit=0", "limit=501", "offset=a"])
+    def test_paging_out_of_bounds_is_rejected(self, query):
+        assert self.client.get(f"/api/v1/groups/?{query}").status_code == 422
+        assert not self.calls
@@ -0,0 +1,141 @@
+import asyncio
+import base64
+import json
+import time
+
+import pytest
+from cachetools import TLRUCache
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from app import api
+
+
+def encode_token_part(part: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+
+
+def make_token(key_id: str, payload: dict) -> HTTPAuthorizationCredentials:
+    credentials = f"{encode_token_part({'alg': 'RS256', 'kid': key_id})}.{encode_token_part(payload)}.signature"
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=credentials)
+
+
+def verify(token: HTTPAuthorizationCredentials) -> HTTPAuthorizationCredentials:
+    return asyncio.run(api.verify_token(token))
+
+
+class TestVerifyToken:
+    now: float
+    calls: list
+    refreshes: list
+    claims: dict | None
+    token: HTTPAuthorizationCredentials
+
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch):
+        self.now = 1000.0
+        self.calls = []
+        self.refreshes = []
+        self.claims = {"sub": "1", "exp": 1010.0}
+        self.token = make_token("known", {"sub": "1", "exp": 1010.0})
+
+        def validate(token):
+            self.calls.append(token)
+            if isinstance(self.claims, Exception):
+                raise self.claims
+            return self.claims
+
+        def get_signing_key_ids(refresh=False):
+            self.refreshes.append(refresh)
+            return {"known"}
+
+        monkeypatch.setattr(api.jwt_validator, "validate", validate)
+        monkeypatch.setattr(api, "get_signing_key_ids", get_signing_key_ids)
+        monkeypatch.setattr(api, "token_cache", TLRUCache(maxsize=16, ttu=lambda _token, expiration, _now: expiration,
+                                                          timer=lambda: self.now))
+
+    def test_cache_hit_skips_validation(self):
+        assert verify(self.token) is self.token
+        assert verify(self.token) is self.token
+        assert len(self.calls) == 1
+
+    def test_expired_entry_is_validated_again(self):
+        verify(self.token)
+        self.now = 1011.0
+        self.claims = {"sub": "1", "exp": 1100.0}
+        verify(self.token)
+        assert len(self.calls) == 2
+
+    def test_token_without_exp_is_not_cached(self):
+        self.claims = {"sub": "1"}
+        verify(self.token)
+        verify(self.token)
+        assert len(self.calls) == 2
+        assert self.token.credentials not in api.token_cache
+
+    def test_validator_returning_nothing_caches_until_payload_exp(self):
+        self.claims = None
+        assert verify(self.token) is self.token
+        self.now = 1009.0
+        assert self.token.credentials in api.token_cache
+        self.now = 1011.0
+        assert self.token.credentials not in api.token_cache
+
+    def test_validator_http_exception_is_kept(self):
+        self.claims = HTTPException(status_code=401, detail="Token expired")
+        with pytest.raises(HTTPException) as e:
+            verify(self.token)
+        assert e.value.detail == "Token expired"
+        assert self.token.credentials not in api.token_cache
+
+    def test_validator_error_is_rejected(self):
+        self.claims = ValueError("Signature verification failed")
+        with pytest.raises(HTTPException) as e:
+            verify(self.token)
+        assert e.value.status_code == 401
+        assert self.token.credentials not in api.token_cache
+
+    def test_unknown_key_id_is_rejected_without_validation(self):
+        with pytest.raises(HTTPException) as e:
+            verify(make_token("forged", {"sub": "1", "exp": 9999999999}))
+        assert e.value.status_code == 401
+        assert self.refreshes == [False, True]
+        assert not self.calls
+        assert not api.token_cache
+
+    def test_malformed_token_is_rejected_without_validation(self):
+        for credentials in ["not-a-jwt", "not.base64!.json", f"{encode_token_part({'kid': 'known'})}.W10.signature"]:
+            with pytest.raises(HTTPException) as e:
+                verify(HTTPAuthorizationCredentials(scheme="Bearer", credentials=credentials))
+            assert e.value.status_code == 401
+        assert not self.calls
+
+
+class TestVerifyTokenWithValidator:
+    access_token: HTTPAuthorizationCredentials
+
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch, access_token):
+        self.access_token = HTTPAuthorizationCredentials(scheme="Bearer", credentials=access_token)
+        monkeypatch.setattr(api, "token_cache", TLRUCache(maxsize=16, ttu=lambda _token, expiration, _now: expiration,
+                                                          timer=time.time))
+
+    def test_valid_token_is_cached_until_exp(self):
+        assert verify(self.access_token) is self.access_token
+        assert self.access_token.credentials in api.token_cache
+
+    def test_tampered_token_is_rejected(self):
+        header, payload, signature = self.access_token.credentials.split(".")
+        claims = api.decode_token_part(self.access_token.credentials, 1)
+        tampered = f"{header}.{encode_token_part({**claims, 'sub': 'someone else'})}.{signature}"
+        with pytest.raises(HTTPException) as e:
+            verify(HTTPAuthorizationCredentials(scheme="Bearer", credentials=tampered))
+        assert e.value.status_code == 401
+        assert tampered not in api.token_cache
+
+    def test_unknown_key_id_is_rejected(self):
+        forged = make_token("forged", api.decode_token_part(self.access_token.credentials, 1))
+        with pytest.raises(HTTPException) as e:
+            verify(forged)
+        assert e.value.status_code == 401
+        assert forged.credentials not in api.token_cache
@@ -0,0 +1,24 @@
+import asyncio
+import json
+
+import pytest
+from corelib.domain.errors import NotFoundError, DuplicateError
+
+import main
+
+
+class TestExceptionHandlers:
+    @pytest.mark.parametrize("error, handler, status_code, detail", [
+        (NotFoundError("Group not found"), main.not_found_error_handler, 404, "Group not found"),
+        (DuplicateError("Group already exists"), main.duplicate_error_handler, 409, "Group already exists"),
+        (ValueError("Invalid nickname"), main.value_error_handler, 400, "Invalid nickname"),
+        (Exception("boom"), main.internal_error_handler, 500, "Internal server error: boom"),
+    ])
+    def test_handler(self, error, handler, status_code, detail):
+        assert main.app.exception_handlers[type(error)] is handler
+        response = asyncio.run(handler(None, error))
+        assert response.status_code == status_code
+        if detail is None:
+            assert response.body == b""
+        else:
+            assert json.loads(response.body) == {"detail": detail}
@@ -0,0 +1,259 @@
+from typing import List
+
+import pytest
+from corelib.domain.errors import NotFoundError, DuplicateError
+from corelib.domain.models import User, Group
+
+from app.repositories import Neo4jGroupRepository
+from test.conftest import Graph
+
+
+class TestAddMemberToGroup:
+    repo: Neo4jGroupRepository
+    graph: Graph
+    user1: User
+    user2: User
+    group: Group
+
+    @pytest.fixture(autouse=True)
+    def setup(self, repo, graph):
+        self.repo = repo
+        self.graph = graph
+        self.user1 = graph.user("a", today_steps=10, this_week_steps=70)
+        self.user2 = graph.user("b", today_steps=5, this_week_steps=30)
+        self.group = graph.group("g", self.user1)
+
+    def test_add_member_adds_steps(self):
+        self.repo.add_member_to_group(self.user2.id, self.group.id)
+        members = self.repo.get_members_of_group(self.group.id)
+        assert {member.id for member in members} == {self.user1.id, self.user2.id}
+        group = self.repo.get_one(self.group.id)
+        assert (group.today_steps, group.this_week_steps) == (15, 100)
+
+    def test_group_not_found(self):
+        with pytest.raises(NotFoundError, match="Group not found"):
+            self.repo.add_member_to_group(self.user2.id, self.graph.new_group("missing").id)
+
+    def test_user_not_found(self):
+        with pytest.raises(NotFoundError, match="User not found"):
+            self.repo.add_member_to_group(f"{self.graph.prefix}missing", self.group.id)
+
+    def test_already_member_of_the_group(self):
+        with pytest.raises(DuplicateError, match="already a member of the group"):
+            self.repo.add_member_to_group(self.user1.id, self.group.id)
+        group = self.repo.get_one(self.group.id)
+        assert (group.today_steps, group.this_week_steps) == (10, 70)
+
+    def test_already_member_of_another_group(self):
+        other = self.graph.group("o", self.user2)
+        with pytest.raises(DuplicateError, match="already a member of a group"):
+            self.repo.add_member_to_group(self.user2.id, self.group.id)
+        assert [member.id for member in self.repo.get_members_of_group(self.group.id)] == [self.user1.id]
+        assert [member.id for member in self.repo.get_members_of_group(other.id)] == [self.user2.id]
+
+
+class TestRemoveMemberFromGroup:
+    repo: Neo4jGroupRepository
+    graph: Graph
+    user1: User
+    user2: User
+    group: Group
+
+    @pytest.fixture(autouse=True)
+    def setup(self, repo, graph):
+        self.repo = repo
+        self.graph = graph
+        self.user1 = graph.user("a", today_steps=10, this_week_steps=70)
+        self.user2 = graph.user("b", today_steps=5, this_week_steps=30)
+        self.group = graph.group("g", self.user1, self.user2)
+
+    def test_remove_member_subtracts_steps(self):
+        self.repo.remove_member_from_group(self.user2.id, self.group.id)
+        assert [member.id for member in self.repo.get_members_of_group(self.group.id)] == [self.user1.id]
+        group = self.repo.get_one(self.group.id)
+        assert (group.today_steps, group.this_week_steps) == (10, 70)
+
+    def test_last_member_deletes_group(self):
+        self.repo.remove_member_from_group(self.user1.id, self.group.id)
+        self.repo.remove_member_from_group(self.user2.id, self.group.id)
+        with pytest.raises(NotFoundError):
+            self.repo.get_one(self.group.id)
+
+    def test_group_not_found(self):
+        with pytest.raises(NotFoundError, match="Group not found"):
+            self.repo.remove_member_from_group(self.user1.id, self.graph.new_group("missing").id)
+
+    def test_user_not_found(self):
+        with pytest.raises(NotFoundError, match="User not found"):
+            self.repo.remove_member_from_group(f"{self.graph.prefix}missing", self.group.id)
+
+    def test_user_not_a_member_changes_nothing(self):
+        outsider = self.graph.user("c", today_steps=1, this_week_steps=1)
+        self.repo.remove_member_from_group(outsider.id, self.group.id)
+        assert len(self.repo.get_members_of_group(self.group.id)) == 2
+        group = self.repo.get_one(self.group.id)
+        assert (group.today_steps, group.this_week_steps) == (15, 100)
+
+
+class TestAddGroup:
+    repo: Neo4jGroupRepository
+    graph: Graph
+    user1: User
+    user2: User
+
+    @pytest.fixture(autouse=True)
+    def setup(self, repo, graph):
+        self.repo = repo
+        self.graph = graph
+        self.user1 = graph.user("a", today_steps=10, this_week_steps=70)
+        self.user2 = graph.user("b")
+
+    def test_add_with_member_creates_group_with_member(self):
+        group = self.graph.new_group("g")
+        self.repo.add_with_member(group, self.user1.id)
+        assert self.repo.get_one(group.id).nickname == group.nickname
+        assert [member.id for member in self.repo.get_members_of_group(group.id)] == [self.user1.id]
+
+    def test_add_with_member_user_not_found_creates_nothing(self):
+        group = self.graph.new_group("g")
+        with pytest.raises(NotFoundError, match="User not found"):
+            self.repo.add_with_member(group, f"{self.graph.prefix}missing")
+        with pytest.raises(NotFoundError):
+            self.repo.get_one(group.id)
+
+    def test_add_with_member_user_with_group_creates_nothing(self):
+        self.graph.group("o", self.user1)
+        group = self.graph.new_group("g")
+        with pytest.raises(DuplicateError, match="already has a group"):
+            self.repo.add_with_member(group, self.user1.id)
+        with pytest.raises(NotFoundError):
+            self.repo.get_one(group.id)
+
+    def test_add_with_member_existing_group_adds_no_member(self):
+        existing = self.graph.group("g", self.user1)
+        with pytest.raises(DuplicateError, match="Group already exists"):
+            self.repo.add_with_member(self.graph.new_group("g"), self.user2.id)
+        assert [member.id for member in self.repo.get_members_of_group(existing.id)] == [self.user1.id]
+        other = self.graph.new_group("o")
+        self.repo.add_with_member(other, self.user2.id)
+        assert [member.id for member in self.repo.get_members_of_group(other.id)] == [self.user2.id]
+
+    def test_add(self):
+        group = self.graph.new_group("g")
+        self.repo.add(group)
+        assert self.repo.get_members_of_group(group.id) == []
+        with pytest.raises(DuplicateError, match="Group already exists"):
+            self.repo.add(self.graph.new_group("g"))
+
+
+class TestMemberErrorPrecedence:
+    repo: Neo4jGroupRepository
+    graph: Graph
+    user: User
+    group: Group
+
+    @pytest.fixture(autouse=True)
+    def setup(self, repo, graph):
+        self.repo = repo
+        self.graph = graph
+        self.user = graph.user("a")
+        self.group = graph.group("g", self.user)
+
+    def test_add_missing_group_before_missing_user(self):
+        with pytest.raises(NotFoundError, match="Group not found"):
+            self.repo.add_member_to_group(f"{self.graph.prefix}missing", self.graph.new_group("missing").id)
+
+    def test_add_missing_group_before_membership(self):
+        with pytest.raises(NotFoundError, match="Group not found"):
+            self.repo.add_member_to_group(self.user.id, self.graph.new_group("missing").id)
+
+    def test_add_missing_user_before_membership(self):
+        with pytest.raises(NotFoundError, match="User not found"):
+            self.repo.add_member_to_group(f"{self.graph.prefix}missing", self.group.id)
+
+    def test_add_same_group_before_other_group(self):
+        with pytest.raises(DuplicateError, match="already a member of the group"):
+            self.repo.add_member_to_group(self.user.id, self.group.id)
+
+    def test_remove_missing_group_before_missing_user(self):
+        with pytest.raises(NotFoundError, match="Group not found"):
+            self.repo.remove_member_from_group(f"{self.graph.prefix}missing", self.graph.new_group("missing").id)
+
+    def test_remove_missing_group_keeps_membership(self):
+        with pytest.raises(NotFoundError, match="Group not found"):
+            self.repo.remove_member_from_group(self.user.id, self.graph.new_group("missing").id)
+        assert [member.id for member in self.repo.get_members_of_group(self.group.id)] == [self.user.id]
+
+
+class TestGetFiltered:
+    repo: Neo4jGroupRepository
+    filter: str
+    alpha: Group
+    alphabet: Group
+    beta: Group
+    both: Group
+
+    @pytest.fixture(autouse=True)
+    def setup(self, repo, graph):
+        self.repo = repo
+        self.filter = f"{graph.prefix}alpha"
+        self.alpha = graph.group("alpha")
+        self.alphabet = graph.group("alphabet")
+        self.beta = graph.group("beta", name=f"{graph.prefix}alphateam")
+        self.both = graph.group("alpha2", name=f"{graph.prefix}alpha2")
+
+    def ids(self, *args, **kwargs) -> list:
+        return [group.id for group in self.repo.get_filtered(self.filter, *args, **kwargs)]
+
+    def test_exact_nickname(self):
+        assert self.ids(name_also=False, loose=False) == [self.alpha.id]
+
+    def test_loose_nickname(self):
+        assert set(self.ids(name_also=False, loose=True)) == {self.alpha.id, self.alphabet.id, self.both.id}
+
+    def test_exact_nickname_and_name(self):
+        self.filter = self.beta.name
+        assert self.ids(name_also=True, loose=False) == [self.beta.id]
+        assert self.ids(name_also=False, loose=False) == []
+
+    def test_loose_nickname_and_name(self):
+        assert set(self.ids(name_also=True, loose=True)) == {self.alpha.id, self.alphabet.id, self.beta.id,
+                                                             self.both.id}
+
+    def test_group_matching_both_fields_is_returned_once(self):
+        self.filter = self.both.nickname
+        assert self.ids(name_also=True, loose=False) == [self.both.id]
+        assert len(self.ids(name_also=True, loose=True)) == 1
+
+    def test_pages_are_stable(self):
+        everything = self.ids(name_also=True, loose=True)
+        assert everything == sorted(everything)
+        pages = [self.ids(name_also=True, loose=True, skip=skip, limit=3) for skip in range(0, 6, 3)]
+        assert pages[0] + pages[1] == everything
+        assert pages == [self.ids(name_also=True, loose=True, skip=skip, limit=3) for skip in range(0, 6, 3)]
+
+
+class TestGetPage:
+    repo: Neo4jGroupRepository
+    groups: List[Group]
+
+    @pytest.fixture(autouse=True)
+    def setup(self, repo, graph):
+        self.repo = repo
+        self.groups = [graph.group(name) for name in ["a", "b", "c"]]
+
+    def test_pages_are_ordered_and_disjoint(self):
+        everything = [group.id for group in self.repo.get_page(0, 500)]
+        assert everything == sorted(everything)
+        pages = [[group.id for group in self.repo.get_page(skip, 2)] for skip in range(0, 6, 2)]
+        assert all(len(page) <= 2 for page in pages)
+        assert pages[0] + pages[1] + pages[2] == everything[:6]
+
+    def test_walking_the_pages_returns_every_group_once(self):
+        walked = []
+        page = self.repo.get_page(0, 100)
+        while page:
+            walked += [group.id for group in page]
+            page = self.repo.get_page(len(walked), 100)
+        assert len(walked) == len(set(walked))
+        assert {group.id for group in self.groups} <= set(walked)
@@ -0,0 +1,32 @@
+import pytest
+from corelib.domain.models import User, Group
+
+from app.services import GroupServices
+
+
+class TestGroupServicesMembers:
+    services: GroupServices
+    user1: User
+    user2: User
+    group: Group
+
+    @pytest.fixture(autouse=True)
+    def setup(self, repo, graph):
+        self.services = GroupServices(repo)
+        self.user1 = graph.user("a", today_steps=10, this_week_steps=70)
+        self.user2 = graph.user("b", today_steps=5, this_week_steps=30)
+        self.group = graph.group("g", self.user1)
+
+    def test_add_member_invalidates_cache(self):
+        assert self.services.get_group(self.group.id).today_steps == 10
+        assert len(self.services.get_members_of_group(self.group.id)) == 1
+        self.services.add_member_to_group(self.user2.id, self.group.id)
+        assert self.services.get_group(self.group.id).today_steps == 15
+        assert len(self.services.get_members_of_group(self.group.id)) == 2
+
+    def test_remove_member_invalidates_cache(self):
+        self.services.add_member_to_group(self.user2.id, self.group.id)
+        assert len(self.services.get_members_of_group(self.group.id)) == 2
+        self.services.remove_member_from_group(self.user2.id, self.group.id)
+        assert self.services.get_group(self.group.id).this_week_steps == 70
+        assert len(self.services.get_members_of_group(self.group.id)) == 1
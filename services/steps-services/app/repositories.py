@@ -1,54 +1,71 @@
+import functools
+from typing import List
+
 from corelib.domain.errors import NotFoundError
 from corelib.domain.models import User
-from neo4j import Neo4jDriver, GraphDatabase
+from neo4j import Neo4jDriver, GraphDatabase, Record, RoutingControl
 
 from app.config import AppConfig
 
+config = AppConfig()
+database = config.neo4j_config.get("DATABASE", "neo4j")
+
+
+@functools.lru_cache(maxsize=1)
+def default_driver() -> Neo4jDriver:
+    """
+    Creates the driver shared by the repositories on first use
+
+    :return: the driver
+    """
+    return GraphDatabase.driver(uri=config.neo4j_config["HOST"],
+                                auth=(config.neo4j_config["USER"], config.neo4j_config["PASSWORD"]),
+                                max_connection_pool_size=config.neo4j_config.getint("POOL_SIZE", fallback=100),
+                                connection_acquisition_timeout=30)
+
 
 class Neo4jStepsRepository:
     """Neo4J repository operations for steps"""
 
     driver: Neo4jDriver
 
-    def __init__(self, driver: Neo4jDriver = GraphDatabase.driver(uri=AppConfig().neo4j_config['HOST'], auth=(
-            AppConfig().neo4j_config['USER'], AppConfig().neo4j_config['PASSWORD']))) -> None:
-        self.driver = driver
+    def __init__(self, driver: Neo4jDriver | None = None) -> None:
+        self.driver = driver or default_driver()
+
+    def _execute(self, query: str, routing: RoutingControl = RoutingControl.WRITE, **parameters) -> List[Record]:
+        """
+        Runs a single query in a driver managed transaction on the configured
+        database
+
+        :param query: the query to run
+        :param routing: whether the query reads or writes
+        :param parameters: the query parameters
+        :return: the records returned by the query
+        """
+        return self.driver.execute_query(query, parameters, routing_=routing, database_=database).records
 
     def add_new_steps(self, user_id: str, steps: int) -> None:
-        def _add_new_steps(tx, user_primary_key: str, number_of_steps: str):
-            result = tx.run(f"MATCH (u:User {{{User.__primarykey__}: '{user_primary_key}'}}) "
-                            f"RETURN u "
-                            f"LIMIT 1")
-            if result.single():
-                tx.run(f"MATCH (u:User {{{User.__primarykey__}: '{user_primary_key}'}}) "
-                       f"SET u.today_steps = u.today_steps + {number_of_steps}, "
-                       f"u.this_week_steps = u.this_week_steps + {number_of_steps} "
-                       f"WITH u "
-                       f"MATCH (u)-[:MEMBER_OF]->(g:Group) "
-                       f"SET g.today_steps = g.today_steps + {number_of_steps}, "
-                       f"g.this_week_steps = u.this_week_steps + {number_of_steps} ")
-            else:
-                raise NotFoundError("User not found")
-
-        with self.driver.session() as session:
-            session.write_transaction(_add_new_steps, user_id, str(steps))
+        records = self._execute(f"MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                                f"SET u.today_steps = u.today_steps + $steps, "
+                                f"u.this_week_steps = u.this_week_steps + $steps "
+                                f"WITH u "
+                                f"OPTIONAL MATCH (u)-[:MEMBER_OF]->(g:Group) "
+                                f"SET g.today_steps = g.today_steps + $steps, "
+                                f"g.this_week_steps = g.this_week_steps + $steps "
+                                f"RETURN count(DISTINCT u) AS matched", user_id=user_id, steps=steps)
+        if not records[0]["matched"]:
+            raise NotFoundError("User not found")
 
     def reset_all_daily_steps(self) -> None:
-        def _reset_all_daily_steps(tx):
-            tx.run(f"MATCH (u:User) "
-                   f"SET today_steps = 0")
-            tx.run(f"MATCH (g:Groups) "
-                   f"SET today_steps = 0")
-
-        with self.driver.session() as session:
-            session.write_transaction(_reset_all_daily_steps)
+        self._execute("MATCH (u:User) "
+                      "SET u.today_steps = 0 "
+                      "WITH count(*) AS users "
+                      "MATCH (g:Group) "
+                      "SET g.today_steps = 0")
 
     def reset_all_weekly_steps(self) -> None:
-        def _reset_all_weekly_steps(tx):
-            tx.run(f"MATCH (u:User) "
-                   f"SET this_week_steps = 0")
-            tx.run(f"MATCH (g:Groups) "
-                   f"SET this_week_steps = 0")
-
-        with self.driver.session() as session:
-            session.write_transaction(_reset_all_weekly_steps)
+        self._execute("MATCH (u:User) "
+                      "SET u.this_week_steps = 0 "
+                      "WITH count(*) AS users "
+                      "MATCH (g:Group) "
+                      "SET g.this_week_steps = 0")
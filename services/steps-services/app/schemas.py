@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+
+class AddStepsRequest(BaseModel):
+    """The body of a request for adding new steps"""
+    steps: int
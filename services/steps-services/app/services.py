@@ -1,59 +1,139 @@
-from datetime import datetime, timedelta
-from threading import Thread
+import fcntl
+import logging
+import threading
+from typing import IO
 
-import pause
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from cachetools import TTLCache
+from corelib.domain.errors import NotFoundError
 
 from app.repositories import Neo4jStepsRepository
 
+logger = logging.getLogger(__name__)
+
 
 class StepsServices:
     """The services associated with the steps related operations"""
 
-    def __init__(self, steps_repo_utils: Neo4jStepsRepository) -> None:
+    def __init__(self, steps_repo_utils: Neo4jStepsRepository, not_found_ttl: float = 10) -> None:
         self.steps_repo_utils = steps_repo_utils
+        self.not_found_cache = TTLCache(maxsize=10_000, ttl=not_found_ttl)
+        self.cache_lock = threading.Lock()
+        self.scheduler = BackgroundScheduler()
+        self.scheduler_lock = threading.Lock()
+        self.leader_lock_file: IO | None = None
 
     def add_new_steps(self, user_id: str, steps: int) -> None:
         """
-        Adds new steps to the user
+        Adds new steps to the user. Users found missing are remembered for a
+        short time, so repeated requests for them are rejected without a query
 
         :param user_id: the id of the user
         :param steps: the steps to add
         :return: None
         :raises NotFoundError: if the user cannot be found in the repository
         """
-        self.steps_repo_utils.add_new_steps(user_id, steps)
+        with self.cache_lock:
+            if user_id in self.not_found_cache:
+                raise NotFoundError("User not found")
+        try:
+            self.steps_repo_utils.add_new_steps(user_id, steps)
+        except NotFoundError:
+            with self.cache_lock:
+                self.not_found_cache[user_id] = True
+            raise
+
+    def reset_today_steps(self) -> None:
+        """
+        Resets the today steps of all users and groups
+
+        :return: None
+        """
+        self.steps_repo_utils.reset_all_daily_steps()
+        logger.info("Today steps reset")
+
+    def reset_this_week_steps(self) -> None:
+        """
+        Resets this week's steps of all users and groups
+
+        :return: None
+        """
+        self.steps_repo_utils.reset_all_weekly_steps()
+        logger.info("This week's steps reset")
+
+    def run_background_tasks(self, leader_lock_path: str = "/tmp/steps-services-scheduler.lock",
+                             leader_retry_interval: float = 60) -> None:
+        """
+        Runs the background tasks for the steps related operations: the today
+        steps are reset every midnight and this week's steps every Monday at
+        midnight. Only the process holding the lock on the leader lock file
+        runs them, so several workers on the same host reset the steps once.
+        The other processes keep trying to take the lock, so one of them takes
+        over when the leader exits. Calling this again while the tasks are
+        running does nothing
+
+        :param leader_lock_path: the file locked by the process running the tasks
+        :param leader_retry_interval: the seconds between two attempts to take
+        the lock
+        :return: None
+        """
+        with self.scheduler_lock:
+            if self.scheduler.running:
+                return
+            if not self._become_leader(leader_lock_path):
+                self.scheduler.add_job(self._retry_leadership, IntervalTrigger(seconds=leader_retry_interval),
+                                       args=[leader_lock_path], id="retry_leadership", replace_existing=True)
+            self.scheduler.start()
+
+    def _become_leader(self, leader_lock_path: str) -> bool:
+        """
+        Takes the lock on the leader lock file, without waiting, and schedules
+        the resets if it got it
 
-    def run_background_tasks(self):
+        :param leader_lock_path: the file locked by the process running the tasks
+        :return: whether this process is now the leader
         """
-        Runs the background tasks for the steps related operations
+        lock_file = open(leader_lock_path, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self.leader_lock_file = lock_file
+        self.scheduler.add_job(self.reset_today_steps, CronTrigger(hour=0, minute=0), id="reset_today_steps",
+                               replace_existing=True)
+        self.scheduler.add_job(self.reset_this_week_steps, CronTrigger(day_of_week="mon", hour=0, minute=0),
+                               id="reset_this_week_steps", replace_existing=True)
+        logger.info("Running the steps resets in this process")
+        return True
 
+    def _retry_leadership(self, leader_lock_path: str) -> None:
+        """
+        Tries again to take the lock on the leader lock file, and stops trying
+        once it got it
+
+        :param leader_lock_path: the file locked by the process running the tasks
         :return: None
         """
+        with self.scheduler_lock:
+            if self.leader_lock_file is None and self._become_leader(leader_lock_path):
+                self.scheduler.remove_job("retry_leadership")
+
+    def stop_background_tasks(self) -> None:
+        """
+        Stops the background tasks, waiting for a running reset to finish, and
+        gives up the lock on the leader lock file if this process held it
 
-        def _reset_today_steps():
-            """
-            Resets the today steps of all users and groups
-
-            :return: None
-            """
-            while True:
-                pause.until(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1))
-                self.steps_repo_utils.reset_all_daily_steps()
-                print("Today steps reset")
-
-        def _reset_this_week_steps():
-            """
-            Resets this week's steps of all users and groups
-
-            :return: None
-            """
-            while True:
-                pause.until(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(
-                    days=(7 - datetime.now().weekday())))
-                self.steps_repo_utils.reset_all_weekly_steps()
-                print("This week's steps reset")
-
-        thread1 = Thread(target=_reset_today_steps)
-        thread2 = Thread(target=_reset_this_week_steps)
-        thread1.start()
-        thread2.start()
+        :return: None
+        """
+        with self.scheduler_lock:
+            if not self.scheduler.running:
+                return
+        # Outside of the lock, which a running retry of the leadership waits on
+        self.scheduler.shutdown()
+        with self.scheduler_lock:
+            if self.leader_lock_file is not None:
+                self.leader_lock_file.close()
+                self.leader_lock_file = None
@@ -1,7 +1,64 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
 
-from app.api import router
+from corelib.domain.errors import NotFoundError
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 
-app = FastAPI(openapi_url="/api/v1/steps/openapi.json", docs_url="/api/v1/steps/docs")
+from app.api import router, steps_repository, steps_services
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the background tasks when the app starts, and stops them and
+    closes the connections to the database on shutdown
+
+    :param app: the app
+    """
+    await run_in_threadpool(steps_services.run_background_tasks)
+    yield
+    await run_in_threadpool(steps_services.stop_background_tasks)
+    await run_in_threadpool(steps_repository.driver.close)
+
+
+app = FastAPI(openapi_url="/api/v1/steps/openapi.json", docs_url="/api/v1/steps/docs",
+              default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.include_router(router, prefix='/api/v1/steps')
+
+
+@app.exception_handler(NotFoundError)
+async def not_found_error_handler(request: Request, exc: NotFoundError):
+    """
+    Responds with 404 when a resource cannot be found
+
+    :param request: the request that failed
+    :param exc: the raised error
+    :return: the error response
+    """
+    return ORJSONResponse(status_code=404, content={"detail": str(exc)})
+
+
+@app.exception_handler(ValueError)
+async def value_error_handler(request: Request, exc: ValueError):
+    """
+    Responds with 400 when the request data is not valid
+
+    :param request: the request that failed
+    :param exc: the raised error
+    :return: the error response
+    """
+    return ORJSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(Exception)
+async def internal_error_handler(request: Request, exc: Exception):
+    """
+    Responds with 500 when an unexpected error occurs
+
+    :param request: the request that failed
+    :param exc: the raised error
+    :return: the error response
+    """
+    return ORJSONResponse(status_code=500, content={"detail": f"Internal server error: {str(exc)}"})
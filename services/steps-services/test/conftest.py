@@ -0,0 +1,18 @@
+import http.client
+import json
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def access_token() -> str:
+    conn = http.client.HTTPSConnection("dev-ed4pmqgq.eu.auth0.com")
+    payload = "{\"client_id\":\"V6ZVwOyzvgxrhqiZJeb1RHGypfVORq3T\"," \
+              "\"client_secret\":\"2eOAvMzqd1BX7QF9D" \
+              "-Fl6iom1B8pbXFvJVX7uMPp9PDTkL2_wBrmFLGh3ojlivCc\"," \
+              "\"audience\":\"mooover/api\",\"grant_type\":\"client_credentials\"} "
+    headers = {'content-type': "application/json"}
+    conn.request("POST", "/oauth/token", payload, headers)
+    res = conn.getresponse()
+    data = res.read()
+    return json.loads(data)["access_token"]
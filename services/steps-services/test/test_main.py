@@ -0,0 +1,23 @@
+import asyncio
+import json
+
+import pytest
+from corelib.domain.errors import NotFoundError
+
+import main
+
+
+class TestExceptionHandlers:
+    @pytest.mark.parametrize("error, handler, status_code, detail", [
+        (NotFoundError("User not found"), main.not_found_error_handler, 404, "User not found"),
+        (ValueError("Invalid steps"), main.value_error_handler, 400, "Invalid steps"),
+        (Exception("boom"), main.internal_error_handler, 500, "Internal server error: boom"),
+    ])
+    def test_handler(self, error, handler, status_code, detail):
+        assert main.app.exception_handlers[type(error)] is handler
+        response = asyncio.run(handler(None, error))
+        assert response.status_code == status_code
+        if detail is None:
+            assert response.body == b""
+        else:
+            assert json.loads(response.body) == {"detail": detail}
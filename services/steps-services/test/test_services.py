@@ -0,0 +1,116 @@
+import pytest
+from cachetools import TTLCache
+from corelib.domain.errors import NotFoundError
+
+from app import api
+from app.services import StepsServices
+
+
+class StepsRepositoryStub:
+    """Steps repository keeping the steps of its users in memory"""
+
+    def __init__(self, *user_ids: str) -> None:
+        self.steps = {user_id: 0 for user_id in user_ids}
+
+    def add_new_steps(self, user_id: str, steps: int) -> None:
+        if user_id not in self.steps:
+            raise NotFoundError("User not found")
+        self.steps[user_id] += steps
+
+    def reset_all_daily_steps(self) -> None:
+        pass
+
+    def reset_all_weekly_steps(self) -> None:
+        pass
+
+
+class TestStepsServicesScheduler:
+    lock_path: str
+    leader: StepsServices
+    follower: StepsServices
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        self.lock_path = str(tmp_path / "scheduler.lock")
+        self.leader = StepsServices(StepsRepositoryStub())
+        self.follower = StepsServices(StepsRepositoryStub())
+        yield
+        self.leader.stop_background_tasks()
+        self.follower.stop_background_tasks()
+
+    @staticmethod
+    def job_ids(services: StepsServices) -> set:
+        return {job.id for job in services.scheduler.get_jobs()}
+
+    def test_only_one_service_schedules_the_resets(self):
+        self.leader.run_background_tasks(self.lock_path)
+        self.follower.run_background_tasks(self.lock_path)
+        assert self.job_ids(self.leader) == {"reset_today_steps", "reset_this_week_steps"}
+        assert self.job_ids(self.follower) == {"retry_leadership"}
+
+    def test_follower_takes_over_when_the_leader_stops(self):
+        self.leader.run_background_tasks(self.lock_path)
+        self.follower.run_background_tasks(self.lock_path)
+        self.follower._retry_leadership(self.lock_path)
+        assert self.job_ids(self.follower) == {"retry_leadership"}
+        self.leader.stop_background_tasks()
+        self.follower._retry_leadership(self.lock_path)
+        assert self.job_ids(self.follower) == {"reset_today_steps", "reset_this_week_steps"}
+
+    def test_running_twice_does_nothing(self):
+        self.leader.run_background_tasks(self.lock_path)
+        self.leader.run_background_tasks(self.lock_path)
+        assert self.job_ids(self.leader) == {"reset_today_steps", "reset_this_week_steps"}
+
+    def test_importing_the_api_schedules_nothing(self):
+        assert not api.steps_services.scheduler.running
+
+    def test_resets_are_scheduled_at_midnight(self):
+        self.leader.run_background_tasks(self.lock_path)
+        daily = {field.name: str(field) for field in self.leader.scheduler.get_job("reset_today_steps").trigger.fields}
+        weekly = {field.name: str(field)
+                  for field in self.leader.scheduler.get_job("reset_this_week_steps").trigger.fields}
+        assert (daily["day_of_week"], daily["hour"], daily["minute"]) == ("*", "0", "0")
+        assert (weekly["day_of_week"], weekly["hour"], weekly["minute"]) == ("mon", "0", "0")
+
+    def test_resets_are_logged(self, caplog):
+        with caplog.at_level("INFO", logger="app.services"):
+            self.leader.reset_today_steps()
+            self.leader.reset_this_week_steps()
+        assert caplog.messages == ["Today steps reset", "This week's steps reset"]
+
+
+class TestStepsServicesNotFoundCache:
+    now: float
+    repo: StepsRepositoryStub
+    services: StepsServices
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.now = 1000.0
+        self.repo = StepsRepositoryStub("1")
+        self.services = StepsServices(self.repo)
+        self.services.not_found_cache = TTLCache(maxsize=16, ttl=10, timer=lambda: self.now)
+
+    def test_add_new_steps(self):
+        self.services.add_new_steps("1", 5)
+        self.services.add_new_steps("1", 5)
+        assert self.repo.steps["1"] == 10
+
+    def test_unknown_user_is_remembered_until_expiry(self):
+        with pytest.raises(NotFoundError):
+            self.services.add_new_steps("2", 5)
+        self.repo.steps["2"] = 0
+        self.now = 1009.0
+        with pytest.raises(NotFoundError):
+            self.services.add_new_steps("2", 5)
+        assert self.repo.steps["2"] == 0
+        self.now = 1011.0
+        self.services.add_new_steps("2", 5)
+        assert self.repo.steps["2"] == 5
+
+    def test_known_users_are_not_affected(self):
+        with pytest.raises(NotFoundError):
+            self.services.add_new_steps("2", 5)
+        self.services.add_new_steps("1", 5)
+        assert self.repo.steps["1"] == 5
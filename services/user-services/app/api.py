@@ -1,46 +1,138 @@
-import functools
-from typing import Any
-
-from corelib.domain.errors import NotFoundError, DuplicateError, NoContentError
+import base64
+import hashlib
+import json
+import threading
+import time
+import urllib.request
+from typing import Mapping, Set
+
+import orjson
+from cachetools import TLRUCache, TTLCache
 from corelib.utils.validators import JwtValidator
-from fastapi import APIRouter, HTTPException, Depends, Request
-from fastapi.security import HTTPBearer
-from starlette.responses import JSONResponse, Response
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.responses import Response
 
 from app.config import AppConfig
 from app.repositories import Neo4jUserRepository
+from app.schemas import AddUserRequest, UpdateUserRequest
 from app.services import UserServices
 
 router = APIRouter()
 
-jwt_validator = JwtValidator(AppConfig().auth0_config)
+config = AppConfig()
+
+jwt_validator = JwtValidator(config.auth0_config)
+bearer_scheme = HTTPBearer(auto_error=False)
+token_cache = TLRUCache(maxsize=4096, ttu=lambda _token, expiration, _now: expiration, timer=time.time)
+signing_key_ids = TTLCache(maxsize=1, ttl=600)
+signing_key_ids_lock = threading.Lock()
 
 user_repository = Neo4jUserRepository()
 user_services = UserServices(user_repository)
 
 
-def require_auth(func) -> Any:
+def get_signing_key_ids(refresh: bool = False) -> Set[str]:
     """
-    Decorator to check for authorization before giving access to resources
+    Gets the ids of the keys tokens can be signed with, from the JWKS of the
+    tenant, cached for 10 minutes. A refresh downloads the JWKS again at most
+    once a minute, so that tokens with unknown key ids cannot make every
+    request download it
 
-    :param func: the function that needs to be decorated
-    :return: the decorated function
+    :param refresh: whether the JWKS should be downloaded again
+    :return: the key ids
+    :raises HTTPException: if the JWKS cannot be downloaded
     """
+    with signing_key_ids_lock:
+        cached = signing_key_ids.get("keys")
+        if cached and (not refresh or time.monotonic() - cached[0] < 60):
+            return cached[1]
+        try:
+            with urllib.request.urlopen(f"https://{config.auth0_config['DOMAIN']}/.well-known/jwks.json",
+                                        timeout=5) as response:
+                key_ids = {key["kid"] for key in json.load(response)["keys"]}
+        except (OSError, ValueError, KeyError):
+            raise HTTPException(status_code=503, detail="Signing keys unavailable")
+        signing_key_ids["keys"] = (time.monotonic(), key_ids)
+        return key_ids
 
-    @functools.wraps(func)
-    async def wrapper_require_auth(*args, **kwargs):
-        validate_bearer_token(kwargs["bearer_token"])
-        return await func(*args, **kwargs)
 
-    def validate_bearer_token(bearer_token) -> None:
-        if not bearer_token:
-            raise HTTPException(status_code=401, detail="User not authenticated")
-        if bearer_token.scheme != "Bearer":
-            raise HTTPException(status_code=401, detail="Authorization header must be "
-                                                        "of type bearer")
-        jwt_validator.validate(bearer_token.credentials)
+def decode_token_part(token: str, index: int) -> dict:
+    """
+    Decodes the header or the payload of a token, without verifying it
+
+    :param token: the token
+    :param index: 0 for the header, 1 for the payload
+    :return: the decoded part
+    :raises ValueError: if the part is not a base64 encoded JSON object
+    """
+    part = token.split(".")[index]
+    decoded = json.loads(base64.urlsafe_b64decode(part + "=" * (-len(part) % 4)))
+    if not isinstance(decoded, dict):
+        raise ValueError("Token part is not an object")
+    return decoded
 
-    return wrapper_require_auth
+
+async def verify_token(
+        bearer_token: HTTPAuthorizationCredentials | None = Depends(bearer_scheme)) -> HTTPAuthorizationCredentials:
+    """
+    Dependency checking for authorization before giving access to resources.
+    The validator only verifies tokens signed with a key id of the JWKS, so
+    tokens with any other key id are rejected before it is called. Accepted
+    tokens are cached until their exp
+
+    :param bearer_token: the bearer token for authorization
+    :return: the validated bearer token
+    :raises HTTPException: if authorization is invalid
+    """
+    if bearer_token and bearer_token.credentials in token_cache:
+        return bearer_token
+    if not bearer_token:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+    token = bearer_token.credentials
+    if token.count(".") != 2:
+        raise HTTPException(status_code=401, detail="Malformed token")
+    try:
+        key_id = decode_token_part(token, 0).get("kid")
+        payload = decode_token_part(token, 1)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Malformed token")
+    if key_id not in await run_in_threadpool(get_signing_key_ids) and \
+            key_id not in await run_in_threadpool(get_signing_key_ids, True):
+        raise HTTPException(status_code=401, detail="Unknown key id")
+    try:
+        claims = await run_in_threadpool(jwt_validator.validate, token)
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # With a known key id the validator raises on any invalid token, and when
+    # it returns no claims the payload decoded above is the verified one
+    if not isinstance(claims, Mapping):
+        claims = payload
+    if "exp" in claims:
+        token_cache[token] = float(claims["exp"])
+    return bearer_token
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Checks an If-None-Match header against an ETag with the weak comparison of
+    RFC 9110: the header lists one or more tags, each of them possibly weak,
+    or is * to match any current representation
+
+    :param if_none_match: the If-None-Match header, if any
+    :param etag: the ETag of the current representation
+    :return: whether the header matches the ETag
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
 
 
 @router.get("/ping", response_model=str, tags=["ping"])
@@ -50,111 +142,81 @@ async def ping():
 
     :return: a string saying "pong"
     """
-    return "pong"
+    return ORJSONResponse("pong")
 
 
-@router.get("/{user_id}", status_code=200, tags=["user"])
-@require_auth
-async def get_user(user_id: str, bearer_token=Depends(HTTPBearer())):
+@router.get("/{user_id}", status_code=200, response_model=None, tags=["user"])
+async def get_user(user_id: str, request: Request, bearer_token=Depends(verify_token)):
     """
-    Route for getting a user by id
+    Route for getting a user by id. The response carries an ETag, and a
+    request whose If-None-Match matches it gets an empty 304 response
 
     :param user_id: the id of the user
+    :param request: the request, for its If-None-Match header
     :param bearer_token: the bearer token for authorization
     :return: the corresponding user
     :raises HTTPException: if user not found or authorization is invalid
     """
-    try:
-        user = user_services.get_user(user_id)
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
-    return user.as_dict()
+    user = await run_in_threadpool(user_services.get_user, user_id)
+    content = orjson.dumps(user.as_dict(), option=orjson.OPT_SORT_KEYS)
+    etag = f'"{hashlib.md5(content).hexdigest()}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=content, media_type="application/json", headers={"ETag": etag})
 
 
-@router.get("/", status_code=200, tags=["user"])
-@require_auth
-async def get_users(bearer_token=Depends(HTTPBearer())):
+@router.get("/", status_code=200, response_model=None, tags=["user"])
+async def get_users(offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500),
+                    bearer_token=Depends(verify_token)):
     """
-    Route for getting all users
+    Route for getting a page of users
 
+    :param offset: the number of users to skip
+    :param limit: the maximum number of users to return
     :param bearer_token: the bearer token for authorization
-    :return: a list of all users
+    :return: a list of users
     :raises HTTPException: if authorization is invalid
     """
-    try:
-        users = user_services.get_users()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    users = await run_in_threadpool(user_services.get_users, offset, limit)
     return [user.as_dict() for user in users]
 
 
 @router.post("/", status_code=201, tags=["user"])
-@require_auth
-async def register_user(request: Request, bearer_token=Depends(HTTPBearer())):
+async def register_user(body: AddUserRequest, bearer_token=Depends(verify_token)):
     """
     Route for registering a new user
 
-    :param request: the request object containing the user to be registered
+    :param body: the user to be registered
     :param bearer_token: the bearer token for authorization
     :return: status message
     :raises HTTPException: if authorization is invalid or user already exists or
     if user is not a valid user
     """
-    try:
-        json_data = await request.json()
-        user_services.add_user(json_data["sub"], json_data["name"], json_data["given_name"], json_data["family_name"],
-                               json_data["nickname"], json_data["email"], json_data["picture"], )
-    except DuplicateError as e:
-        raise HTTPException(status_code=409, detail=str(e))
-    except KeyError:
-        raise HTTPException(status_code=400, detail="Missing required fields")
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    await run_in_threadpool(user_services.add_user, body.sub, body.name, body.given_name, body.family_name,
+                            body.nickname, body.email, body.picture, )
     return {"message": "User added"}
 
 
 @router.put("/{user_id}", status_code=200, tags=["user"])
-@require_auth
-async def update_user(user_id: str, request: Request, bearer_token=Depends(HTTPBearer())):
+async def update_user(user_id: str, body: UpdateUserRequest, bearer_token=Depends(verify_token)):
     """
     Route for updating a user
 
     :param user_id: the id of the user to be updated
-    :param request: the request object containing the user to be updated
+    :param body: the updated user
     :param bearer_token: the bearer token for authorization
     :return: status message
     :raises HTTPException: if user not found or authorization is invalid or if
     user is not a valid user
     """
-    try:
-        json_data = await request.json()
-        user_services.update_user(json_data["sub"], json_data["name"], json_data["given_name"],
-                                  json_data["family_name"], json_data["nickname"], json_data["email"],
-                                  json_data["picture"], json_data["today_steps"], json_data["daily_steps_goal"],
-                                  json_data["this_week_steps"], json_data["weekly_steps_goal"],
-                                  json_data["app_theme"], )
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except KeyError:
-        raise HTTPException(status_code=400, detail="Missing required fields")
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    await run_in_threadpool(user_services.update_user, body.sub, body.name, body.given_name, body.family_name,
+                            body.nickname, body.email, body.picture, body.today_steps, body.daily_steps_goal,
+                            body.this_week_steps, body.weekly_steps_goal, body.app_theme, )
     return {"message": "User updated"}
 
 
-@router.get("/{user_id}/steps", status_code=200, tags=["user, steps"])
-@require_auth
-async def get_user_steps(user_id: str, bearer_token=Depends(HTTPBearer())):
+@router.get("/{user_id}/steps", status_code=200, response_model=None, tags=["user, steps"])
+async def get_user_steps(user_id: str, bearer_token=Depends(verify_token)):
     """
     Route for getting the steps of a user
 
@@ -163,19 +225,12 @@ async def get_user_steps(user_id: str, bearer_token=Depends(HTTPBearer())):
     :return: the steps of the user
     :raises HTTPException: if user not found or authorization is invalid
     """
-    try:
-        today_steps, this_week_steps = user_services.get_user_steps(user_id)
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
+    today_steps, this_week_steps = await run_in_threadpool(user_services.get_user_steps, user_id)
     return {"today_steps": today_steps, "this_week_steps": this_week_steps}
 
 
 @router.get("/{user_id}/group", status_code=204, tags=["user", "group"], response_class=Response)
-@require_auth
-async def get_group_of_user(user_id: str, bearer_token=Depends(HTTPBearer())):
+async def get_group_of_user(user_id: str, bearer_token=Depends(verify_token)):
     """
     Route for getting a user's group
 
@@ -184,13 +239,5 @@ async def get_group_of_user(user_id: str, bearer_token=Depends(HTTPBearer())):
     :return: the corresponding group
     :raises HTTPException: if user not found or authorization is invalid
     """
-    try:
-        group = user_services.get_group_of_user(user_id)
-    except NotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except NoContentError as e:
-        return None
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: "
-                                                    f"{str(e)}")
-    return JSONResponse(content=group.as_dict(), status_code=200)
+    group = await run_in_threadpool(user_services.get_group_of_user, user_id)
+    return ORJSONResponse(content=group.as_dict(), status_code=200)
@@ -1,23 +1,71 @@
-from typing import List
+import functools
+import logging
+from typing import List, Tuple
 
 from corelib.domain.errors import NotFoundError, DuplicateError
 from corelib.domain.models import User, Group
 from corelib.repositories import Repository
-from neo4j import Neo4jDriver, GraphDatabase, Result
+from neo4j import Neo4jDriver, GraphDatabase, Record, RoutingControl
+from neo4j.exceptions import ConstraintError, Neo4jError
 
 from app.config import AppConfig
 
+config = AppConfig()
+database = config.neo4j_config.get("DATABASE", "neo4j")
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=1)
+def default_driver() -> Neo4jDriver:
+    """
+    Creates the driver shared by the repositories on first use
+
+    :return: the driver
+    """
+    return GraphDatabase.driver(uri=config.neo4j_config["HOST"],
+                                auth=(config.neo4j_config["USER"], config.neo4j_config["PASSWORD"]),
+                                max_connection_pool_size=config.neo4j_config.getint("POOL_SIZE", fallback=100),
+                                connection_acquisition_timeout=30)
+
 
 class Neo4jUserRepository(Repository):
     """Neo4J repository for users"""
 
     driver: Neo4jDriver
 
-    def __init__(self, driver: Neo4jDriver = GraphDatabase.driver(uri=AppConfig().neo4j_config['HOST'], auth=(
-            AppConfig().neo4j_config['USER'], AppConfig().neo4j_config['PASSWORD']))) -> None:
-        self.driver = driver
+    def __init__(self, driver: Neo4jDriver | None = None) -> None:
+        self.driver = driver or default_driver()
         super().__init__({})
 
+    def _execute(self, query: str, routing: RoutingControl = RoutingControl.WRITE, **parameters) -> List[Record]:
+        """
+        Runs a single query in a driver managed transaction on the configured
+        database
+
+        :param query: the query to run
+        :param routing: whether the query reads or writes
+        :param parameters: the query parameters
+        :return: the records returned by the query
+        """
+        return self.driver.execute_query(query, parameters, routing_=routing, database_=database).records
+
+    def ensure_schema(self) -> None:
+        """
+        Creates the uniqueness constraint on the user key used for lookups, if
+        it does not exist. Each statement runs in its own retried transaction,
+        and a statement that still fails, for example because of existing
+        duplicate keys, is logged instead of stopping the service
+
+        :return: None
+        """
+        for statement in [f"CREATE CONSTRAINT user_{User.__primarykey__}_unique IF NOT EXISTS "
+                          f"FOR (u:User) REQUIRE u.{User.__primarykey__} IS UNIQUE"]:
+            try:
+                self._execute(statement)
+            except Neo4jError as e:
+                logger.warning("Could not apply the user schema: %s", e)
+
     def get_one(self, user_id: str) -> User:
         """
         Get one user by id
@@ -26,19 +74,13 @@ class Neo4jUserRepository(Repository):
         :return: The user
         :raises NotFoundError: If the user does not exist
         """
-
-        def _get_user(tx, primary_key: str):
-            result: Result = tx.run(f"MATCH (u:User {{{User.__primarykey__}: '{primary_key}'}}) "
-                                    f"RETURN u "
-                                    f"LIMIT 1")
-            record = result.single()
-            if record:
-                return User(**record.data()['u'])
-            else:
-                raise NotFoundError("User not found")
-
-        with self.driver.session() as session:
-            return session.read_transaction(_get_user, user_id)
+        records = self._execute(f"MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                                f"RETURN properties(u) AS p "
+                                f"LIMIT 1", RoutingControl.READ, user_id=user_id)
+        if records:
+            return User(**records[0]["p"])
+        else:
+            raise NotFoundError("User not found")
 
     def get_all(self) -> List[User]:
         """
@@ -46,14 +88,24 @@ class Neo4jUserRepository(Repository):
 
         :return: A list of all users
         """
+        records = self._execute("MATCH (u:User) "
+                                "RETURN properties(u) AS p", RoutingControl.READ)
+        return [User(**record["p"]) for record in records]
 
-        def _get_all_users(tx):
-            result = tx.run(f"MATCH (u:User) "
-                            f"RETURN u")
-            return [User(**record.data()['u']) for record in result]
+    def get_page(self, skip: int = 0, limit: int = 50) -> List[User]:
+        """
+        Get a page of users, ordered by id
 
-        with self.driver.session() as session:
-            return session.read_transaction(_get_all_users)
+        :param skip: The number of users to skip
+        :param limit: The maximum number of users to return
+        :return: A list of at most limit users
+        """
+        records = self._execute(f"MATCH (u:User) "
+                                f"WHERE u.{User.__primarykey__} IS NOT NULL "
+                                f"WITH u ORDER BY u.{User.__primarykey__} "
+                                f"SKIP $skip LIMIT $limit "
+                                f"RETURN properties(u) AS p", RoutingControl.READ, skip=skip, limit=limit)
+        return [User(**record["p"]) for record in records]
 
     def add(self, user: User) -> None:
         """
@@ -63,16 +115,16 @@ class Neo4jUserRepository(Repository):
         :return: None
         :raises DuplicateError: If the user already exists
         """
-
-        def _add_user(tx, user: User):
-            tx.run(f"CREATE (u:User {user.as_str_dict()})", )
-
         try:
-            self.get_one(getattr(user, User.__primarykey__))
+            records = self._execute(f"OPTIONAL MATCH (existing:User {{{User.__primarykey__}: $user_id}}) "
+                                    f"WITH existing WHERE existing IS NULL "
+                                    f"CREATE (u:User $props) "
+                                    f"RETURN count(u) AS created",
+                                    user_id=getattr(user, User.__primarykey__), props=user.as_dict())
+        except ConstraintError:
+            raise DuplicateError("User already exists")
+        if not records[0]["created"]:
             raise DuplicateError("User already exists")
-        except NotFoundError:
-            with self.driver.session() as session:
-                session.write_transaction(_add_user, user)
 
     def update(self, user: User) -> None:
         """
@@ -82,15 +134,12 @@ class Neo4jUserRepository(Repository):
         :return: None
         :raises NotFoundError: If the user does not exist
         """
-
-        def _update_user(tx, user: User):
-            tx.run(f"MATCH (u:User {{{User.__primarykey__}: "
-                   f"'{getattr(user, User.__primarykey__)}'}}) "
-                   f"SET u = {user.as_str_dict()}")
-
-        self.get_one(getattr(user, User.__primarykey__))
-        with self.driver.session() as session:
-            session.write_transaction(_update_user, user)
+        records = self._execute(f"MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                                f"SET u = $props "
+                                f"RETURN count(u) AS matched",
+                                user_id=getattr(user, User.__primarykey__), props=user.as_dict())
+        if not records[0]["matched"]:
+            raise NotFoundError("User not found")
 
     def delete(self, user_id: str) -> None:
         """
@@ -100,30 +149,39 @@ class Neo4jUserRepository(Repository):
         :return: None
         :raises: NotFoundError: If the user does not exist
         """
+        records = self._execute(f"MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                                f"DETACH DELETE u "
+                                f"RETURN count(u) AS matched", user_id=user_id)
+        if not records[0]["matched"]:
+            raise NotFoundError("User not found")
 
-        def _delete_user(tx, primary_key: str):
-            tx.run(f"MATCH (u:User {{{User.__primarykey__}: '{primary_key}'}}) "
-                   f"DETACH DELETE u")
-
-        self.get_one(user_id)
-        with self.driver.session() as session:
-            session.write_transaction(_delete_user, user_id)
-
-    def get_groups_of_user(self, user_id: str) -> List[Group]:
+    def get_steps(self, user_id: str) -> Tuple[int, int]:
         """
-        Get all the groups of a user
+        Get only the steps counters of a user
 
         :param user_id: The id of the user
-        :return: A list of groups
+        :return: The today and this week's steps of the user
         :raises NotFoundError: If the user does not exist
         """
+        records = self._execute(f"MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                                f"RETURN u.today_steps AS today_steps, u.this_week_steps AS this_week_steps "
+                                f"LIMIT 1", RoutingControl.READ, user_id=user_id)
+        if not records:
+            raise NotFoundError("User not found")
+        return records[0]["today_steps"], records[0]["this_week_steps"]
+
+    def get_first_group_of_user(self, user_id: str) -> Group | None:
+        """
+        Get the first group of a user
 
-        def _get_groups_of_user(tx, primary_key: str):
-            result = tx.run(f"MATCH (u:User {{{User.__primarykey__}: '{primary_key}'}}) "
-                            f"-[:MEMBER_OF]->(g:Group) "
-                            f"RETURN g", )
-            return [Group(**record.data()['g']) for record in result]
-
-        self.get_one(user_id)
-        with self.driver.session() as session:
-            return session.read_transaction(_get_groups_of_user, user_id)
+        :param user_id: The id of the user
+        :return: The group, or None if the user has no group
+        :raises NotFoundError: If the user does not exist
+        """
+        records = self._execute(f"MATCH (u:User {{{User.__primarykey__}: $user_id}}) "
+                                f"OPTIONAL MATCH (u)-[:MEMBER_OF]->(g:Group) "
+                                f"RETURN properties(g) AS p "
+                                f"LIMIT 1", RoutingControl.READ, user_id=user_id)
+        if not records:
+            raise NotFoundError("User not found")
+        return Group(**records[0]["p"]) if records[0]["p"] is not None else None
@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+
+
+class AddUserRequest(BaseModel):
+    """The body of a request for registering a new user"""
+    sub: str
+    name: str
+    given_name: str
+    family_name: str
+    nickname: str
+    email: str
+    picture: str
+
+
+class UpdateUserRequest(BaseModel):
+    """The body of a request for updating a user"""
+    sub: str
+    name: str
+    given_name: str
+    family_name: str
+    nickname: str
+    email: str
+    picture: str
+    today_steps: int
+    daily_steps_goal: int
+    this_week_steps: int
+    weekly_steps_goal: int
+    app_theme: str
@@ -1,5 +1,7 @@
+import threading
 from typing import List
 
+from cachetools import TTLCache
 from corelib.domain.errors import NoContentError
 from corelib.domain.models import User, Group
 
@@ -9,8 +11,11 @@ from app.repositories import Neo4jUserRepository
 class UserServices:
     """The services associated with the user related operations"""
 
-    def __init__(self, repo: Neo4jUserRepository) -> None:
+    def __init__(self, repo: Neo4jUserRepository, cache_ttl: float = 5, list_cache_ttl: float = 5) -> None:
         self.user_repo = repo
+        self.user_cache = TTLCache(maxsize=10_000, ttl=cache_ttl)
+        self.list_cache = TTLCache(maxsize=1000, ttl=list_cache_ttl)
+        self.cache_lock = threading.Lock()
 
     def get_user(self, user_id: str) -> User:
         """
@@ -20,15 +25,30 @@ class UserServices:
         :return: the user
         :raises NotFoundError: if the user cannot be found in the repository
         """
-        return self.user_repo.get_one(user_id)
-
-    def get_users(self) -> List[User]:
+        with self.cache_lock:
+            user = self.user_cache.get(user_id)
+        if user is None:
+            user = self.user_repo.get_one(user_id)
+            with self.cache_lock:
+                self.user_cache[user_id] = user
+        return user
+
+    def get_users(self, offset: int = 0, limit: int = 50) -> List[User]:
         """
-        Gets all the users
+        Gets a page of the users
 
+        :param offset: the number of users to skip
+        :param limit: the maximum number of users to return
         :return: the users
         """
-        return self.user_repo.get_all()
+        key = (offset, limit)
+        with self.cache_lock:
+            users = self.list_cache.get(key)
+        if users is None:
+            users = self.user_repo.get_page(offset, limit)
+            with self.cache_lock:
+                self.list_cache[key] = users
+        return users
 
     def add_user(self, sub: str, name: str, given_name: str, family_name: str, nickname: str, email: str,
                  picture: str) -> None:
@@ -50,6 +70,7 @@ class UserServices:
         user = User(sub=sub, name=name, given_name=given_name, family_name=family_name, nickname=nickname, email=email,
                     picture=picture, )
         self.user_repo.add(user)
+        self._invalidate(user.id)
 
     def update_user(self, sub: str, name: str, given_name: str, family_name: str, nickname: str, email: str,
                     picture: str, today_steps: int, daily_steps_goal: int, this_week_steps: int, weekly_steps_goal: int,
@@ -77,6 +98,7 @@ class UserServices:
                     picture=picture, today_steps=today_steps, daily_steps_goal=daily_steps_goal,
                     this_week_steps=this_week_steps, weekly_steps_goal=weekly_steps_goal, app_theme=app_theme)
         self.user_repo.update(user)
+        self._invalidate(user.id)
 
     def get_group_of_user(self, user_id: str) -> Group:
         """
@@ -87,11 +109,10 @@ class UserServices:
         :raises NotFoundError: if the user cannot be found in the repository
         :raises NoContentError: if the user has no group
         """
-        user = self.user_repo.get_one(user_id)
-        groups = self.user_repo.get_groups_of_user(user.id)
-        if len(groups) == 0:
+        group = self.user_repo.get_first_group_of_user(user_id)
+        if group is None:
             raise NoContentError("The user has no group")
-        return groups[0]
+        return group
 
     def get_user_steps(self, user_id: str) -> (int, int):
         """
@@ -101,5 +122,9 @@ class UserServices:
         :return: the steps of the user
         :raises NotFoundError: if the user cannot be found in the repository
         """
-        user = self.user_repo.get_one(user_id)
-        return user.today_steps, user.this_week_steps
+        return self.user_repo.get_steps(user_id)
+
+    def _invalidate(self, user_id: str) -> None:
+        with self.cache_lock:
+            self.user_cache.pop(user_id, None)
+            self.list_cache.clear()
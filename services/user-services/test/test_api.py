@@ -1,11 +1,18 @@
-import http.client
-
 import pytest
+from corelib.domain.models import User
+from corelib.repositories import Repository
 from starlette.testclient import TestClient
 
+from app import api
+from app.services import UserServices
 from main import app
 
 
+@pytest.fixture(scope="module")
+def client() -> TestClient:
+    return TestClient(app)
+
+
 class TestApi:
     client: TestClient
     access_token: str
@@ -13,18 +20,9 @@ class TestApi:
     user2: dict
 
     @pytest.fixture(autouse=True)
-    def setup(self):
-        self.client = TestClient(app)
-        conn = http.client.HTTPSConnection("dev-ed4pmqgq.eu.auth0.com")
-        payload = "{\"client_id\":\"V6ZVwOyzvgxrhqiZJeb1RHGypfVORq3T\"," \
-                  "\"client_secret\":\"2eOAvMzqd1BX7QF9D" \
-                  "-Fl6iom1B8pbXFvJVX7uMPp9PDTkL2_wBrmFLGh3ojlivCc\"," \
-                  "\"audience\":\"mooover/api\",\"grant_type\":\"client_credentials\"} "
-        headers = {'content-type': "application/json"}
-        conn.request("POST", "/oauth/token", payload, headers)
-        res = conn.getresponse()
-        data = res.read()
-        self.access_token = data.decode("utf-8").split("\"")[3]
+    def setup(self, client, access_token):
+        self.client = client
+        self.access_token = access_token
         self.user1 = {"sub": "1", "name": "test", "given_name": "test",
                       "family_name": "test", "nickname": "test",
                       "email": "test@test.test", "picture": "test"}
@@ -74,4 +72,43 @@ class TestApi:
             json=self.user2,
             headers={"Authorization": f"Bearer {self.access_token}"},
         )
-        assert response.status_code == 409
\ No newline at end of file
+        assert response.status_code == 409
+
+
+class TestConditionalGet:
+    client: TestClient
+    user1: User
+
+    @pytest.fixture(autouse=True)
+    def setup(self, client, monkeypatch):
+        self.client = client
+        self.user1 = User(sub='1', name='test', given_name='test', family_name='test', nickname='test',
+                          email='test@test.test', picture='test')
+        monkeypatch.setattr(api, "user_services", UserServices(Repository({self.user1.id: self.user1})))
+        monkeypatch.setitem(app.dependency_overrides, api.verify_token, lambda: None)
+
+    def test_get_user_not_modified(self):
+        response = self.client.get("/api/v1/users/1")
+        assert response.status_code == 200
+        assert response.json()["sub"] == self.user1.sub
+        etag = response.headers["ETag"]
+        response = self.client.get("/api/v1/users/1", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    def test_get_user_modified(self):
+        response = self.client.get("/api/v1/users/1", headers={"If-None-Match": '"stale"'})
+        assert response.status_code == 200
+        assert response.json()["sub"] == self.user1.sub
+
+    @pytest.mark.parametrize("if_none_match", ["{etag}", "W/{etag}", '"other", {etag}', ' "other" ,W/{etag} ', "*"])
+    def test_get_user_not_modified_with_weak_comparison(self, if_none_match):
+        etag = self.client.get("/api/v1/users/1").headers["ETag"]
+        response = self.client.get("/api/v1/users/1", headers={"If-None-Match": if_none_match.format(etag=etag)})
+        assert response.status_code == 304
+
+    @pytest.mark.parametrize("if_none_match", ['"other"', '"other", W/"stale"', "", ","])
+    def test_get_user_modified_with_weak_comparison(self, if_none_match):
+        response = self.client.get("/api/v1/users/1", headers={"If-None-Match": if_none_match})
+        assert response.status_code == 200
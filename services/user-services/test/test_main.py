@@ -0,0 +1,25 @@
+import asyncio
+import json
+
+import pytest
+from corelib.domain.errors import NotFoundError, DuplicateError, NoContentError
+
+import main
+
+
+class TestExceptionHandlers:
+    @pytest.mark.parametrize("error, handler, status_code, detail", [
+        (NotFoundError("User not found"), main.not_found_error_handler, 404, "User not found"),
+        (DuplicateError("User already exists"), main.duplicate_error_handler, 409, "User already exists"),
+        (NoContentError("The user has no group"), main.no_content_error_handler, 204, None),
+        (ValueError("Invalid email"), main.value_error_handler, 400, "Invalid email"),
+        (Exception("boom"), main.internal_error_handler, 500, "Internal server error: boom"),
+    ])
+    def test_handler(self, error, handler, status_code, detail):
+        assert main.app.exception_handlers[type(error)] is handler
+        response = asyncio.run(handler(None, error))
+        assert response.status_code == status_code
+        if detail is None:
+            assert response.body == b""
+        else:
+            assert json.loads(response.body) == {"detail": detail}
@@ -33,3 +33,11 @@ class TestUserServices:
         with pytest.raises(DuplicateError):
             self.services.add_user(self.user2.sub, self.user2.name, self.user2.given_name, self.user2.family_name,
                                    self.user2.nickname, self.user2.email, self.user2.picture)
+
+    def test_update_user_invalidates_cache(self):
+        self.services.get_user(self.user1.id)
+        self.services.update_user(self.user1.sub, 'updated', self.user1.given_name, self.user1.family_name,
+                                  self.user1.nickname, self.user1.email, self.user1.picture, self.user1.today_steps,
+                                  self.user1.daily_steps_goal, self.user1.this_week_steps,
+                                  self.user1.weekly_steps_goal, self.user1.app_theme)
+        assert self.services.get_user(self.user1.id).name == 'updated'